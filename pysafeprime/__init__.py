@@ -1,6 +1,48 @@
+import importlib
+import sys
+
 from .pysafeprime import is_prime
+from .pysafeprime import is_prime_bpsw
+from .pysafeprime import is_prime_many
+from .pysafeprime import miller_rabin_rounds
 from .pysafeprime import random_prime
+from .pysafeprime import random_prime_many
+from .pysafeprime import screen_small_factors
 from .pysafeprime import safe_prime
+from .pysafeprime import fast_safe_prime
+from .pysafeprime import fast_safe_prime_2
+from .pysafeprime import threads_run_in_parallel
+from .pysafeprime import add_hook
+from .pysafeprime import remove_hook
+from .pysafeprime import GenerationStats
+from .pysafeprime import GenerationTimeout
+from .pool import SafePrimePool
+from .stepwise import PrimeSearch
+from .stepwise import SafePrimeSearch
+from .stepwise import SafePrimeSearch2
+from .backend import get_backend
+from .backend import set_backend
 
+# These are imported on first use, since asyncio, and the benchmark and
+# regression modules behind the cost estimator, take longer to import than
+# the rest of the package.
+_LAZY = {
+    'estimate_cost': 'cost',
+    'random_prime_async': 'aio',
+    'safe_prime_async': 'aio',
+    'fast_safe_prime_async': 'aio',
+    'fast_safe_prime_2_async': 'aio',
+    'primes_async': 'aio',
+    'safe_primes_async': 'aio',
+}
 
-
+if sys.version_info >= (3, 7):
+    def __getattr__(name):
+        if name not in _LAZY:
+            raise AttributeError("module %r has no attribute %r" % (__name__, name))
+        module = importlib.import_module('.' + _LAZY[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+else:
+    from .cost import estimate_cost
@@ -0,0 +1,236 @@
+import argparse
+import json
+import numbers
+import sys
+import time
+
+from . import bench
+from . import cost
+from . import pysafeprime
+from . import regression
+from . import trace
+
+# The generator behind each kind of prime, and whether it is a safe prime.
+_KINDS = {
+    'prime': (pysafeprime.random_prime, False),
+    'safe': (pysafeprime.fast_safe_prime, True),
+    'safe2': (pysafeprime.fast_safe_prime_2, True),
+}
+
+def _emit(output, record):
+    """Write one JSON Lines record and flush it, so consumers see it at once."""
+
+    output.write(json.dumps(record, sort_keys = True) + '\n')
+    output.flush()
+
+def _load_jobs(args):
+    """Build the list of jobs from a manifest, or from the command-line options.
+
+    A manifest is a JSON file holding a list of jobs, or an object with a
+    "jobs" list. Each job is an object with "kind", "sizes", "count" and
+    "workers", where every field but "sizes" may be left out.
+
+    Args:
+        args: The parsed command-line arguments.
+
+    Returns:
+        A list of job dicts with every field filled in.
+    """
+
+    if args.manifest:
+        with open(args.manifest) as f:
+            manifest = json.load(f)
+        if isinstance(manifest, dict):
+            manifest = manifest['jobs']
+    else:
+        manifest = [{'kind': args.kind, 'sizes': args.sizes, 'count': args.count, 'workers': args.workers}]
+
+    jobs = []
+    for job in manifest:
+        kind = job.get('kind', 'safe')
+        if kind not in _KINDS:
+            raise Exception("Unknown kind of prime: %s" % kind)
+        sizes = job.get('sizes')
+        if not sizes:
+            raise Exception("Job without sizes: %s" % json.dumps(job))
+        jobs.append({'kind': kind, 'sizes': [int(k) for k in sizes],
+            'count': int(job.get('count', 1)), 'workers': job.get('workers')})
+    return jobs
+
+def generate(args, output):
+    """Generate the primes of every job, writing one record per prime as soon as it is found."""
+
+    recorder = trace.TraceRecorder(args.trace) if args.trace else None
+    try:
+        _generate(args, output)
+    finally:
+        if recorder is not None:
+            recorder.close()
+    return 0
+
+def _generate(args, output):
+    for number, job in enumerate(_load_jobs(args)):
+        func = _KINDS[job['kind']][0]
+        for k in job['sizes']:
+            for index in range(job['count']):
+                start = time.time()
+                p = func(k, workers = job['workers'])
+                _emit(output, {'job': number, 'kind': job['kind'], 'bits': k, 'index': index,
+                    'value': hex(p).rstrip('L'), 'seconds': time.time() - start})
+
+def verify(args, output):
+    """Check the primes in a JSON Lines file, writing one record per prime.
+
+    Returns:
+        1 if any value is not a prime of its kind, else 0.
+    """
+
+    status = 0
+    source = open(args.input) if args.input != '-' else sys.stdin
+    try:
+        for line in source:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            value = record['value']
+            p = value if isinstance(value, numbers.Integral) else int(value, 0)
+            kind = args.kind or record.get('kind', 'prime')
+            valid = pysafeprime.is_prime(p)
+            if valid and _KINDS[kind][1]:
+                valid = pysafeprime.is_prime((p - 1) // 2)
+            if not valid:
+                status = 1
+            _emit(output, {'kind': kind, 'bits': p.bit_length(), 'value': value, 'valid': valid})
+    finally:
+        if source is not sys.stdin:
+            source.close()
+    return status
+
+def run_bench(args, output):
+    """Run the benchmark suite, writing one record per benchmark and size."""
+
+    for result in bench.run_suite(args.benchmarks, args.sizes, args.samples, args.seed):
+        _emit(output, result)
+    return 0
+
+def run_baseline(args, output):
+    """Run the benchmark suite and store its samples as a baseline."""
+
+    regression.record_baseline(args.baseline, args.benchmarks, args.sizes, args.samples, args.seed)
+    return 0
+
+def run_compare(args, output):
+    """Compare against a baseline, writing one record per benchmark and size.
+
+    Returns:
+        1 if any benchmark regressed, else 0.
+    """
+
+    with open(args.baseline) as f:
+        recorded = json.load(f)['machine']
+    if recorded != regression.machine():
+        sys.stderr.write('warning: the baseline was recorded on %s\n' % json.dumps(recorded, sort_keys = True))
+
+    status = 0
+    for result in regression.compare(args.baseline, args.tolerance, args.confidence, args.resamples):
+        if result['regressed']:
+            status = 1
+        _emit(output, result)
+    return status
+
+def run_trace(args, output):
+    """Analyze a search trace, writing one record per generator and size.
+
+    With --sieve-bound or --rounds, the records compare the recorded run
+    times with those the other settings would have given, see trace.simulate.
+    """
+
+    runs = list(trace.read_trace(args.trace))
+    if args.sieve_bound is None and args.rounds is None:
+        results = trace.summarize(runs)
+    else:
+        results = trace.simulate_runs(runs, args.sieve_bound, args.rounds)
+    for result in results:
+        _emit(output, result)
+    return 0
+
+def run_estimate(args, output):
+    """Estimate the generation time on this machine, writing one record per size."""
+
+    calibration = cost.load_calibration(args.calibration)
+    for k in args.sizes:
+        _emit(output, cost.estimate_cost(args.kind, k, args.workers, calibration = calibration))
+    return 0
+
+def _parser():
+    parser = argparse.ArgumentParser(prog = 'python -m pysafeprime',
+        description = 'Generate and check primes, writing JSON Lines to stdout.')
+    commands = parser.add_subparsers(dest = 'command')
+    commands.required = True
+
+    parser_generate = commands.add_parser('generate', help = 'generate primes')
+    parser_generate.add_argument('--manifest', help = 'a JSON job manifest; overrides the options below')
+    parser_generate.add_argument('--kind', choices = sorted(_KINDS), default = 'safe')
+    parser_generate.add_argument('--sizes', type = int, nargs = '+', default = [1024])
+    parser_generate.add_argument('--count', type = int, default = 1)
+    parser_generate.add_argument('--workers', type = int)
+    parser_generate.add_argument('--trace', help = 'a file to append a trace of every search to')
+    parser_generate.set_defaults(func = generate)
+
+    parser_verify = commands.add_parser('verify', help = 'check the primes in a JSON Lines file')
+    parser_verify.add_argument('input', nargs = '?', default = '-', help = 'the file to check, or - for stdin')
+    parser_verify.add_argument('--kind', choices = sorted(_KINDS), help = 'override the kind of every record')
+    parser_verify.set_defaults(func = verify)
+
+    parser_bench = commands.add_parser('bench', help = 'run the benchmark suite')
+    parser_bench.add_argument('--benchmarks', nargs = '+', choices = list(bench.BENCHMARKS))
+    parser_bench.add_argument('--sizes', type = int, nargs = '+', default = bench.SIZES)
+    parser_bench.add_argument('--samples', type = int, default = 100)
+    parser_bench.add_argument('--seed', type = int, default = 0)
+    parser_bench.set_defaults(func = run_bench)
+
+    parser_baseline = commands.add_parser('baseline', help = 'store the benchmark samples of this machine')
+    parser_baseline.add_argument('baseline', help = 'the baseline JSON file to write')
+    parser_baseline.add_argument('--benchmarks', nargs = '+', choices = list(bench.BENCHMARKS))
+    parser_baseline.add_argument('--sizes', type = int, nargs = '+', default = bench.SIZES)
+    parser_baseline.add_argument('--samples', type = int, default = 100)
+    parser_baseline.add_argument('--seed', type = int, default = 0)
+    parser_baseline.set_defaults(func = run_baseline)
+
+    parser_compare = commands.add_parser('compare', help = 'check for regressions against a baseline')
+    parser_compare.add_argument('baseline', help = 'the baseline JSON file to compare against')
+    parser_compare.add_argument('--tolerance', type = float, default = 0.05)
+    parser_compare.add_argument('--confidence', type = float, default = 0.95)
+    parser_compare.add_argument('--resamples', type = int, default = 2000)
+    parser_compare.set_defaults(func = run_compare)
+
+    parser_estimate = commands.add_parser('estimate', help = 'estimate the generation time on this machine')
+    parser_estimate.add_argument('--kind', choices = sorted(_KINDS), default = 'safe')
+    parser_estimate.add_argument('--sizes', type = int, nargs = '+', default = [1024])
+    parser_estimate.add_argument('--workers', type = int)
+    parser_estimate.add_argument('--calibration', help = 'the calibration cache; measured first if missing')
+    parser_estimate.set_defaults(func = run_estimate)
+
+    parser_trace = commands.add_parser('trace', help = 'analyze a search trace')
+    parser_trace.add_argument('trace', help = 'the trace file written by generate --trace')
+    parser_trace.add_argument('--sieve-bound', type = int, help = 'simulate another sieve bound')
+    parser_trace.add_argument('--rounds', type = int, help = 'simulate another number of Miller-Rabin rounds')
+    parser_trace.set_defaults(func = run_trace)
+    return parser
+
+def main(argv = None, output = None):
+    """Run the command line.
+
+    Args:
+        argv: The arguments, without the program name. Defaults to sys.argv[1:].
+        output: The file the JSON Lines are written to. Defaults to stdout.
+
+    Returns:
+        The exit status.
+    """
+
+    args = _parser().parse_args(argv)
+    return args.func(args, output or sys.stdout)
+
+if __name__ == '__main__':
+    sys.exit(main())
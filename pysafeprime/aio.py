@@ -0,0 +1,152 @@
+import asyncio
+import concurrent.futures
+import functools
+import itertools
+import threading
+
+from . import pysafeprime
+
+_executor = None
+
+def get_executor():
+    """Get the executor that generation is run on.
+
+    Unless set_executor was called, this is a thread pool created on first
+    use. Running on threads lets a cancelled task stop its search at the
+    next checkpoint; pass workers= to the generator to spread a single
+    search over processes as well.
+
+    Returns:
+        The concurrent.futures.Executor.
+    """
+
+    global _executor
+    if _executor is None:
+        _executor = concurrent.futures.ThreadPoolExecutor(thread_name_prefix = 'pysafeprime')
+    return _executor
+
+def set_executor(executor):
+    """Set the executor that generation is run on.
+
+    Args:
+        executor: A concurrent.futures.Executor whose workers are threads, or None to
+            go back to the default thread pool.
+    """
+
+    global _executor
+    _executor = executor
+
+def _run_cancellable(stop, func, args, kwargs):
+    """Run a generator on an executor thread under a cancellable search context.
+
+    Args:
+        stop: The Event that cancels the search.
+        func: The generator function.
+        args: The positional arguments of func.
+        kwargs: The keyword arguments of func.
+
+    Returns:
+        The result of func(*args, **kwargs).
+    """
+
+    with pysafeprime._search_context(pysafeprime._SearchContext(stop)):
+        return func(*args, **kwargs)
+
+async def run_async(func, *args, **kwargs):
+    """Run a generator off the event loop.
+
+    If the awaiting task is cancelled, then the search is abandoned at its
+    next checkpoint and its executor thread is freed.
+
+    Args:
+        func: The generator function, e.g., pysafeprime.fast_safe_prime.
+        args: The positional arguments of func.
+        kwargs: The keyword arguments of func.
+
+    Returns:
+        The result of func(*args, **kwargs).
+    """
+
+    loop = asyncio.get_running_loop()
+    stop = threading.Event()
+    call = functools.partial(_run_cancellable, stop, func, args, kwargs)
+    try:
+        return await loop.run_in_executor(get_executor(), call)
+    except asyncio.CancelledError:
+        stop.set()
+        raise
+
+async def random_prime_async(k, **kwargs):
+    """Generate a random k-bit prime off the event loop. See random_prime."""
+
+    return await run_async(pysafeprime.random_prime, k, **kwargs)
+
+async def safe_prime_async(k, **kwargs):
+    """Generate a 2k-bit prime with Gordon's algorithm off the event loop. See safe_prime."""
+
+    return await run_async(pysafeprime.safe_prime, k, **kwargs)
+
+async def fast_safe_prime_async(k, **kwargs):
+    """Generate a k-bit safe prime off the event loop. See fast_safe_prime."""
+
+    return await run_async(pysafeprime.fast_safe_prime, k, **kwargs)
+
+async def fast_safe_prime_2_async(k, **kwargs):
+    """Generate a k-bit safe prime off the event loop. See fast_safe_prime_2."""
+
+    return await run_async(pysafeprime.fast_safe_prime_2, k, **kwargs)
+
+async def iterate_async(func, *args, count = None, maxsize = 1, **kwargs):
+    """Generate results one after another as an async iterator.
+
+    A producer task generates results off the event loop into a queue of
+    at most maxsize results. It only starts on the next result once there is
+    room in the queue, so a slow consumer throttles generation instead of
+    letting results pile up. Closing the iterator, or cancelling the task
+    that consumes it, cancels the generation in progress.
+
+    Args:
+        func: The generator function, e.g., pysafeprime.fast_safe_prime.
+        args: The positional arguments of func.
+        count: The number of results to generate, or None for no limit.
+        maxsize: The number of results generated ahead of the consumer.
+        kwargs: The keyword arguments of func.
+
+    Returns:
+        An async iterator of the results of func(*args, **kwargs).
+    """
+
+    results = asyncio.Queue()
+    # A slot is taken before a result is started, and given back once the
+    # consumer takes a result, so at most maxsize are generated ahead.
+    slots = asyncio.Semaphore(maxsize)
+
+    async def produce():
+        try:
+            for i in (itertools.count() if count is None else range(count)):
+                await slots.acquire()
+                result = await run_async(func, *args, **kwargs)
+                results.put_nowait((True, result))
+        except Exception as e:
+            results.put_nowait((False, e))
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        for i in (itertools.count() if count is None else range(count)):
+            succeeded, result = await results.get()
+            slots.release()
+            if not succeeded:
+                raise result
+            yield result
+    finally:
+        producer.cancel()
+
+def primes_async(k, count = None, maxsize = 1, **kwargs):
+    """Generate random k-bit primes as an async iterator. See iterate_async and random_prime."""
+
+    return iterate_async(pysafeprime.random_prime, k, count = count, maxsize = maxsize, **kwargs)
+
+def safe_primes_async(k, count = None, maxsize = 1, **kwargs):
+    """Generate k-bit safe primes as an async iterator. See iterate_async and fast_safe_prime."""
+
+    return iterate_async(pysafeprime.fast_safe_prime, k, count = count, maxsize = maxsize, **kwargs)
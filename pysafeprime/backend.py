@@ -0,0 +1,140 @@
+import os
+
+class Backend(object):
+    """A set of big-integer primitives that the primality tests are routed to.
+
+    Attributes:
+        name: The name of the backend.
+        powmod: A function (a, e, n) -> a^e mod n.
+        powmod_base_list: A function (bases, e, n) -> [a^e mod n for a in bases], or None.
+        is_strong_prp: A function (n, a) -> True iff n is a strong probable prime to the base a, or None.
+        is_strong_lucas_prp: A function (n) -> True iff n is a strong Lucas probable prime with
+            Selfridge's parameters, or None.
+        releases_gil: True if the primitives release the GIL while they run.
+    """
+
+    def __init__(self, name, powmod, powmod_base_list = None, is_strong_prp = None,
+            is_strong_lucas_prp = None, releases_gil = False):
+        self.name = name
+        self.powmod = powmod
+        self.powmod_base_list = powmod_base_list
+        self.is_strong_prp = is_strong_prp
+        self.is_strong_lucas_prp = is_strong_lucas_prp
+        self.releases_gil = releases_gil
+
+def _python_backend():
+    """The pure-Python backend, which uses CPython integers and the built-in pow."""
+
+    return Backend('python', pow)
+
+def _gmpy2_backend():
+    """The GMP backend, through gmpy2."""
+
+    import gmpy2
+
+    def is_strong_prp(n, a):
+        # gmpy2 only accepts bases coprime to n, and any other base proves n composite.
+        n = gmpy2.mpz(n)
+        if gmpy2.gcd(n, a) != 1:
+            return False
+        return gmpy2.is_strong_prp(n, a)
+
+    powmod_base_list = getattr(gmpy2, 'powmod_base_list', None)
+    if powmod_base_list is None:
+        powmod_base_list = lambda bases, e, n : [gmpy2.powmod(a, e, n) for a in bases]
+
+    return Backend('gmpy2', gmpy2.powmod, powmod_base_list, is_strong_prp,
+        lambda n : gmpy2.is_strong_selfridge_prp(gmpy2.mpz(n)))
+
+def _flint_backend():
+    """The FLINT backend, through python-flint."""
+
+    import flint
+
+    def powmod(a, e, n):
+        return int(pow(flint.fmpz(a), e, flint.fmpz(n)))
+
+    return Backend('flint', powmod, lambda bases, e, n : [powmod(a, e, n) for a in bases])
+
+_LOADERS = {
+    'python': _python_backend,
+    'gmpy2': _gmpy2_backend,
+    'flint': _flint_backend,
+}
+
+# Backends tried in order when none is requested explicitly.
+_PREFERENCE = ['gmpy2', 'flint', 'python']
+
+_loaded = {}
+
+def load_backend(name):
+    """Load a backend by name.
+
+    Args:
+        name: One of 'python', 'gmpy2' or 'flint'.
+
+    Returns:
+        The Backend.
+
+    Raises:
+        Exception: If the backend is unknown or its library is not installed.
+    """
+
+    if name not in _loaded:
+        if name not in _LOADERS:
+            raise Exception("Unknown arithmetic backend: %s" % name)
+        try:
+            _loaded[name] = _LOADERS[name]()
+        except ImportError:
+            raise Exception("Arithmetic backend %s is not installed" % name)
+    return _loaded[name]
+
+def _default_backend():
+    """Pick the backend at import time.
+
+    The PYSAFEPRIME_BACKEND environment variable names the backend to use.
+    Otherwise the first installed backend in _PREFERENCE is used, so GMP is
+    picked up whenever gmpy2 is installed and pure Python is the fallback.
+
+    Returns:
+        The Backend.
+    """
+
+    name = os.environ.get('PYSAFEPRIME_BACKEND')
+    if name:
+        return load_backend(name)
+    for name in _PREFERENCE:
+        try:
+            return load_backend(name)
+        except Exception:
+            pass
+
+_current = _default_backend()
+
+def set_backend(name):
+    """Select the backend used by every call that does not name one.
+
+    Args:
+        name: One of 'python', 'gmpy2' or 'flint'.
+
+    Returns:
+        The Backend.
+    """
+
+    global _current
+    _current = load_backend(name)
+    return _current
+
+def get_backend(name = None):
+    """Get a backend.
+
+    Args:
+        name: The name of the backend, or None for the currently selected one.
+
+    Returns:
+        The Backend.
+    """
+
+    if name is None:
+        return _current
+    return load_backend(name)
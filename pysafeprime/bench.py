@@ -0,0 +1,188 @@
+import binascii
+import collections
+import math
+import random
+import sys
+import timeit
+
+from . import pysafeprime
+
+# The bit sizes the suite runs at by default.
+SIZES = [512, 1024, 2048, 4096, 8192]
+
+def _seeded_random_bytes(seed):
+    """Build a deterministic stand-in for os.urandom.
+
+    Args:
+        seed: The seed of the byte stream.
+
+    Returns:
+        A function (n) -> n pseudorandom bytes.
+    """
+
+    generator = random.Random(seed)
+
+    def random_bytes(n):
+        return binascii.unhexlify('%0*x' % (2 * n, generator.getrandbits(8 * n)))
+
+    return random_bytes
+
+def _random_odd(k):
+    return pysafeprime._random_bit_integer(k) | 1
+
+# Each benchmark takes the bit size k and returns the call to time. Anything
+# random is drawn before the call, from the same seeded source.
+
+def _bench_powmod(k):
+    n = _random_odd(k)
+    powmod = pysafeprime.get_backend().powmod
+    return lambda : powmod(2, n - 1, n)
+
+def _bench_miller_rabin_round(k):
+    n = _random_odd(k)
+    arithmetic = pysafeprime.get_backend()
+    if arithmetic.is_strong_prp is not None:
+        return lambda : arithmetic.is_strong_prp(n, 2)
+    r, s = pysafeprime._split_power_of_two(n - 1)
+    return lambda : pysafeprime._miller_rabin_round(n, 2, r, s, arithmetic.powmod)
+
+def _bench_sieve_window(k):
+    q0 = _random_odd(k - 1)
+    return lambda : pysafeprime._sieve_window(q0, k, pysafeprime._SMALL_PRIMES, True)
+
+def _bench_screen_small_factors(k):
+    values = [_random_odd(k) for i in range(k)]
+    return lambda : pysafeprime.screen_small_factors(values, 2 ** 16)
+
+def _bench_is_prime(k):
+    n = _random_odd(k)
+    return lambda : pysafeprime.is_prime(n)
+
+def _bench_is_prime_bpsw(k):
+    n = _random_odd(k)
+    return lambda : pysafeprime.is_prime_bpsw(n)
+
+BENCHMARKS = collections.OrderedDict([
+    ('powmod', _bench_powmod),
+    ('miller_rabin_round', _bench_miller_rabin_round),
+    ('sieve_window', _bench_sieve_window),
+    ('screen_small_factors', _bench_screen_small_factors),
+    ('is_prime', _bench_is_prime),
+    ('is_prime_bpsw', _bench_is_prime_bpsw),
+    ('random_prime', lambda k : lambda : pysafeprime.random_prime(k)),
+    ('random_prime_incremental', lambda k : lambda : pysafeprime.random_prime(k, incremental = True)),
+    ('safe_prime', lambda k : lambda : pysafeprime.safe_prime(k // 2)),
+    ('fast_safe_prime', lambda k : lambda : pysafeprime.fast_safe_prime(k)),
+    ('fast_safe_prime_2', lambda k : lambda : pysafeprime.fast_safe_prime_2(k)),
+])
+
+def percentile(values, q):
+    """Compute a percentile by the nearest-rank method.
+
+    Args:
+        values: A sorted, non-empty list.
+        q: The percentile, between 0 and 100.
+
+    Returns:
+        The smallest value such that at least q percent of the values are no larger.
+    """
+
+    rank = int(math.ceil((q / 100.0) * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+def measure(name, k, samples, seed = 0):
+    """Run one benchmark at one bit size.
+
+    The random bytes of every call come from a source seeded by seed, name
+    and k, so a run draws the same candidates, and so finds the same primes
+    after the same number of candidates, every time it is repeated.
+
+    Args:
+        name: The name of the benchmark, a key of BENCHMARKS.
+        k: The bit size.
+        samples: The number of timed calls.
+        seed: The seed of the random bytes.
+
+    Returns:
+        A pair (times, candidates) of lists with the wall-clock time, in
+        seconds, and the number of candidates tested for every call.
+    """
+
+    setup = BENCHMARKS[name]
+    # The seeded source only ever lives on the search context of this
+    # thread, so other threads keep drawing from os.urandom meanwhile.
+    context = pysafeprime._SearchContext(random_bytes = _seeded_random_bytes('%s:%s:%d' % (seed, name, k)))
+    times = []
+    candidates = []
+    with pysafeprime._search_context(context):
+        for i in range(samples):
+            context.stats = None
+            call = setup(k)
+            stats = pysafeprime.GenerationStats()
+            context.stats = stats
+            start = timeit.default_timer()
+            call()
+            times.append(timeit.default_timer() - start)
+            candidates.append(stats.candidates)
+    return times, candidates
+
+def summarize(name, k, times, candidates):
+    """Summarize the samples of one benchmark.
+
+    Safe-prime latency is heavy-tailed, so the summary leads with the
+    percentiles rather than the mean.
+
+    Args:
+        name: The name of the benchmark.
+        k: The bit size.
+        times: The time of every call, in seconds.
+        candidates: The number of candidates tested by every call.
+
+    Returns:
+        A dict with the p50, p90, p99, mean and max times, and the mean
+        number of candidates per success, or None if no candidates were tested.
+    """
+
+    ordered = sorted(times)
+    total = sum(candidates)
+    return {
+        'benchmark': name,
+        'bits': k,
+        'samples': len(times),
+        'p50': percentile(ordered, 50),
+        'p90': percentile(ordered, 90),
+        'p99': percentile(ordered, 99),
+        'mean': sum(times) / len(times),
+        'max': ordered[-1],
+        'candidates_per_success': (float(total) / len(candidates)) if total else None,
+    }
+
+def run_suite(names = None, sizes = None, samples = 100, seed = 0):
+    """Run benchmarks across bit sizes.
+
+    The generators at 4096 and 8192 bits take a long time in pure Python,
+    so pick names and sizes to fit the time at hand.
+
+    Args:
+        names: The benchmarks to run. Defaults to all of BENCHMARKS.
+        sizes: The bit sizes. Defaults to SIZES.
+        samples: The number of timed calls per benchmark and size.
+        seed: The seed of the random bytes.
+
+    Returns:
+        A generator of the summary of every benchmark and size, see summarize.
+    """
+
+    for name in (names or list(BENCHMARKS)):
+        for k in (sizes or SIZES):
+            times, candidates = measure(name, k, samples, seed)
+            yield summarize(name, k, times, candidates)
+
+if __name__ == '__main__':
+    sizes = [int(k) for k in sys.argv[1:]] or SIZES
+    for result in run_suite(sizes = sizes):
+        candidates = result['candidates_per_success']
+        sys.stdout.write('%-26s %5d  p50 %10.6fs  p90 %10.6fs  p99 %10.6fs  candidates %s\n' % (
+            result['benchmark'], result['bits'], result['p50'], result['p90'], result['p99'],
+            '-' if candidates is None else '%.1f' % candidates))
+        sys.stdout.flush()
@@ -0,0 +1,250 @@
+import json
+import math
+import multiprocessing
+import os
+
+from . import pysafeprime
+from . import regression
+
+# The bit sizes the cost of a Miller-Rabin round and of a random draw are
+# measured at. Costs at other sizes follow from a power law fitted to them.
+CALIBRATION_SIZES = [256, 512, 1024, 2048]
+
+# The minimum time spent measuring each cost, in seconds.
+_CALIBRATION_SECONDS = 0.05
+
+# The twin prime constant of the Hardy-Littlewood estimate of the density of
+# Sophie Germain primes.
+_TWIN_PRIME_CONSTANT = 0.6601618158468696
+
+# The calibration of this process, once loaded or measured.
+_calibration = None
+
+def default_calibration_path():
+    """Find where the calibration of this machine is cached.
+
+    Returns:
+        The value of the PYSAFEPRIME_CALIBRATION environment variable, or
+        ~/.cache/pysafeprime/calibration.json.
+    """
+
+    return os.environ.get('PYSAFEPRIME_CALIBRATION') or os.path.join(os.path.expanduser('~'), '.cache',
+        'pysafeprime', 'calibration.json')
+
+def _time_per_call(func):
+    """Time the median call of func over at least _CALIBRATION_SECONDS, in seconds."""
+
+    times = []
+    total = 0.0
+    while total < _CALIBRATION_SECONDS or len(times) < 5:
+        start = pysafeprime._timer()
+        func()
+        elapsed = pysafeprime._timer() - start
+        times.append(elapsed)
+        total += elapsed
+    return sorted(times)[len(times) // 2]
+
+def _measure_round(k):
+    arithmetic = pysafeprime.get_backend()
+    n = pysafeprime._random_bit_integer(k) | 1
+    r, s = pysafeprime._split_power_of_two(n - 1)
+
+    def one_round():
+        a = pysafeprime._random_in_range(2, n - 2)
+        if arithmetic.is_strong_prp is not None:
+            return arithmetic.is_strong_prp(n, a)
+        return pysafeprime._miller_rabin_round(n, a, r, s, arithmetic.powmod)
+
+    return _time_per_call(one_round)
+
+def calibrate(path = None):
+    """Measure the costs the estimates are built on, and cache them to disk.
+
+    Args:
+        path: The path of the cache. Defaults to default_calibration_path().
+
+    Returns:
+        A dict with the machine, the calibration sizes, the time of a
+        Miller-Rabin round and of drawing a random integer at every size,
+        and the time per small prime of sieving a window.
+    """
+
+    global _calibration
+
+    n0 = pysafeprime._random_bit_integer(1024) | 1
+    primes = pysafeprime._SMALL_PRIMES
+    calibration = {
+        'machine': regression.machine(),
+        'sizes': CALIBRATION_SIZES,
+        'round_seconds': [_measure_round(k) for k in CALIBRATION_SIZES],
+        'draw_seconds': [_time_per_call(lambda : pysafeprime._random_bit_integer(k)) for k in CALIBRATION_SIZES],
+        'sieve_seconds_per_prime': _time_per_call(lambda : pysafeprime._sieve_window(n0, 1024, primes, True)) /
+            len(primes),
+    }
+
+    path = path or default_calibration_path()
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    temporary = path + '.tmp'
+    with open(temporary, 'w') as f:
+        json.dump(calibration, f, indent = 1, sort_keys = True)
+    os.rename(temporary, path)
+    _calibration = calibration
+    return calibration
+
+def load_calibration(path = None):
+    """Load the cached calibration, measuring it first if it is missing or stale.
+
+    A calibration is stale when it was measured on another machine or with
+    another arithmetic backend.
+
+    Args:
+        path: The path of the cache. Defaults to default_calibration_path().
+
+    Returns:
+        The calibration, see calibrate.
+    """
+
+    global _calibration
+
+    machine = regression.machine()
+    if path is None and _calibration is not None and _calibration['machine'] == machine:
+        return _calibration
+    path = path or default_calibration_path()
+    if os.path.exists(path):
+        with open(path) as f:
+            calibration = json.load(f)
+        if calibration.get('machine') == machine:
+            _calibration = calibration
+            return calibration
+    return calibrate(path)
+
+def _power_law(sizes, values, k):
+    """Fit values = a * sizes^b by least squares on the logarithms, and evaluate it at k."""
+
+    xs = [math.log(x) for x in sizes]
+    ys = [math.log(max(y, 1e-12)) for y in values]
+    mean_x = sum(xs) / len(xs)
+    mean_y = sum(ys) / len(ys)
+    b = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / sum((x - mean_x) ** 2 for x in xs)
+    return math.exp(mean_y + (b * (math.log(k) - mean_x)))
+
+def _sieve_survival(primes, safe):
+    """Compute the fraction of random odd candidates that no prime in primes divides.
+
+    With safe = true, the fraction of candidates q for which neither q nor
+    2q + 1 has a factor in primes.
+    """
+
+    survival = 1.0
+    for r in primes:
+        survival *= 1 - ((2.0 if safe else 1.0) / r)
+    return survival
+
+def _model(kind, k, t, calibration):
+    """Model the search of one generator for a k-bit prime.
+
+    Every search is a sequence of candidates handed to a primality test,
+    each of which is the result with the same probability.
+
+    Returns:
+        A tuple (success, fail_seconds, success_seconds) of the probability
+        that a candidate is the result, the expected time of a candidate that
+        is not, and the time of the one that is.
+    """
+
+    sizes = calibration['sizes']
+    round_cost = lambda bits : _power_law(sizes, calibration['round_seconds'], bits)
+    draw_cost = _power_law(sizes, calibration['draw_seconds'], k)
+    log_2 = math.log(2)
+
+    if kind == 'prime':
+        # Every k-bit integer is drawn, and is prime with probability
+        # 1 / ln n; the even half is rejected before any round.
+        success = 1 / (k * log_2)
+        fail = draw_cost + (((0.5 - success) / (1 - success)) * round_cost(k))
+        return success, fail, draw_cost + (t * round_cost(k))
+
+    if kind == 'safe':
+        bound = pysafeprime._SIEVE_BOUND
+        window = k
+    elif kind == 'safe2':
+        bound = 2 ** 16
+        window = 8 * k
+    else:
+        raise Exception("Unknown kind of prime: %s" % kind)
+
+    primes = [r for r in pysafeprime._small_primes(bound) if r < 2 ** (k - 2)]
+    survival = _sieve_survival(primes, True)
+    # Of the random odd q, a fraction 4 C / (ln q ln 2q) are Sophie Germain
+    # primes, and a fraction 2 / ln q are prime. Sieving keeps all of them,
+    # and removes the rest of the candidates.
+    log_q = (k - 1) * log_2
+    success = min((4 * _TWIN_PRIME_CONSTANT / (log_q * (log_q + log_2))) / survival, 1.0)
+    prime_q = min((2 / log_q) / _sieve_survival(primes, False), 1.0)
+    # The sieve and the random start of every window, spread over its survivors.
+    overhead = ((calibration['sieve_seconds_per_prime'] * len(primes)) + draw_cost) / max(window * survival, 1.0)
+
+    q_cost = round_cost(k - 1)
+    p_cost = round_cost(k)
+    if kind == 'safe':
+        # One round fails a composite q; a prime q takes t rounds, and then
+        # one round fails a composite p.
+        failed = ((1 - prime_q) * q_cost) + ((prime_q - success) * ((t * q_cost) + p_cost))
+        succeeded = t * (q_cost + p_cost)
+    else:
+        # A Fermat test on q, then a Fermat test on p once q is prime, and
+        # Miller-Rabin on q once both are.
+        failed = ((1 - prime_q) * q_cost) + ((prime_q - success) * (q_cost + p_cost))
+        succeeded = (t + 1) * q_cost + p_cost
+    return success, overhead + (failed / (1 - success)), overhead + succeeded
+
+def estimate_cost(kind, k, workers = None, error = None, calibration = None):
+    """Estimate the time this machine takes to generate a prime.
+
+    The estimate combines the density of primes, or of Sophie Germain
+    primes, among the candidates that survive the sieve of each generator
+    with the measured cost of a Miller-Rabin round on this machine (see
+    load_calibration). The number of candidates until a result is
+    geometric, so the quantiles follow from its distribution. With
+    workers, the first of that many independent searches returns, which
+    only helps up to the number of CPUs.
+
+    Args:
+        kind: 'prime' for random_prime, 'safe' for fast_safe_prime or 'safe2' for fast_safe_prime_2.
+        k: The number of bits in the result.
+        workers: The number of searches to run in parallel. Defaults to one.
+        error: The target error probability of the generator, see miller_rabin_rounds.
+        calibration: The calibration to use. Defaults to load_calibration().
+
+    Returns:
+        A dict with the expected time, the p50, p90 and p99 of the time, in
+        seconds, and the expected number of candidates tested per result.
+    """
+
+    calibration = calibration or load_calibration()
+    t = pysafeprime._generation_rounds(k if kind == 'prime' else k - 1, error)
+    success, fail_seconds, success_seconds = _model(kind, k, t, calibration)
+
+    parallel = max(min(workers or 1, multiprocessing.cpu_count()), 1)
+    # All searches test a candidate at a time, so a step of all of them
+    # succeeds with probability 1 - (1 - success)^parallel.
+    step = 1 - ((1 - success) ** parallel)
+
+    def seconds(steps):
+        return ((steps - 1) * fail_seconds) + success_seconds
+
+    def quantile(q):
+        return seconds(max(math.ceil(math.log(1 - q) / math.log(1 - step)), 1)) if step < 1 else seconds(1)
+
+    return {
+        'kind': kind,
+        'bits': k,
+        'workers': parallel,
+        'mean': seconds(1 / step),
+        'p50': quantile(0.5),
+        'p90': quantile(0.9),
+        'p99': quantile(0.99),
+        'candidates': 1 / success,
+    }
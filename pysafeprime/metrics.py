@@ -0,0 +1,275 @@
+import collections
+import threading
+import time
+import timeit
+import weakref
+
+# The metrics kept, by name: their Prometheus type, help text and label names.
+METRICS = collections.OrderedDict([
+    ('pysafeprime_primes_generated_total', ('counter', 'Primes returned by the generators.', ('function', 'bits'))),
+    ('pysafeprime_candidates_tested_total', ('counter', 'Candidates handed to a primality test.', ('function',))),
+    ('pysafeprime_sieve_rejected_total', ('counter', 'Candidates ruled out by a sieve.', ('function',))),
+    ('pysafeprime_rabin_rounds_total', ('counter', 'Miller-Rabin rounds run.', ('function',))),
+    ('pysafeprime_random_bytes_total', ('counter', 'Random bytes drawn from the random source.', ('function',))),
+    ('pysafeprime_cpu_seconds_total', ('counter',
+        'CPU seconds spent in the generators, including their worker threads.', ('function',))),
+    ('pysafeprime_call_seconds', ('histogram', 'Wall-clock seconds per generator call.', ('function', 'bits'))),
+    ('pysafeprime_call_cpu_seconds', ('histogram', 'CPU seconds of the calling thread per generator call.',
+        ('function', 'bits'))),
+])
+
+# The upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0, float('inf'))
+
+# The events of generation that are counted, by stage. See pysafeprime.STAGES.
+_EVENTS = {
+    'candidate': 'pysafeprime_candidates_tested_total',
+    'sieve_rejected': 'pysafeprime_sieve_rejected_total',
+    'round': 'pysafeprime_rabin_rounds_total',
+}
+
+# The CPU time of the current thread, where the platform can tell.
+_thread_time = getattr(time, 'thread_time', None) or getattr(time, 'process_time', None) or time.clock
+
+class _Shard(object):
+    """The metrics recorded by one thread.
+
+    Every thread only ever writes to its own shard, so recording takes no
+    lock. The lock is only taken to register a new shard, to retire it once
+    its thread ends, and to read them all.
+
+    Attributes:
+        counters: A dict mapping (name, labels) to a count.
+        histograms: A dict mapping (name, labels) to the bucket counts, followed by the sum and count.
+        function: The name of the generator call running on the thread, or None.
+        worker: True if the thread runs searches on behalf of a generator call on another thread.
+    """
+
+    __slots__ = ('counters', 'histograms', 'function', 'worker')
+
+    def __init__(self):
+        self.counters = {}
+        self.histograms = {}
+        self.function = None
+        self.worker = False
+
+class _Owner(object):
+    """Holds the shard of a thread in its thread-local storage.
+
+    The owner is dropped with the thread-local storage when its thread ends,
+    which retires the shard.
+    """
+
+    __slots__ = ('shard', '__weakref__')
+
+    def __init__(self, shard):
+        self.shard = shard
+
+# A reentrant lock, since a thread that ends while holding it retires its shard.
+_lock = threading.RLock()
+_shards = []
+# The metrics of the threads that have ended, folded together.
+_retired = _Shard()
+# The weak references that retire shards, kept alive until they fire.
+_owners = set()
+_local = threading.local()
+
+def _fold(target, shard):
+    for key, value in shard.counters.items():
+        target.counters[key] = target.counters.get(key, 0) + value
+    for key, histogram in shard.histograms.items():
+        if key in target.histograms:
+            histogram = [a + b for a, b in zip(target.histograms[key], histogram)]
+        target.histograms[key] = list(histogram)
+
+def _retire(shard, owner):
+    """Fold the shard of a thread that ended into the retired metrics."""
+
+    # Python 2 clears the globals of modules at exit, before the last threads go.
+    if _lock is None:
+        return
+    with _lock:
+        _owners.discard(owner)
+        _shards.remove(shard)
+        _fold(_retired, shard)
+
+def _shard():
+    owner = getattr(_local, 'owner', None)
+    if owner is not None:
+        return owner.shard
+    shard = _Shard()
+    owner = _Owner(shard)
+    _local.owner = owner
+    with _lock:
+        _shards.append(shard)
+        _owners.add(weakref.ref(owner, lambda ref, retire = _retire : retire(shard, ref)))
+    return shard
+
+def _inc(shard, name, labels, value = 1):
+    key = (name, labels)
+    shard.counters[key] = shard.counters.get(key, 0) + value
+
+def _observe(shard, name, labels, value):
+    key = (name, labels)
+    histogram = shard.histograms.get(key)
+    if histogram is None:
+        histogram = [0] * (len(BUCKETS) + 2)
+        shard.histograms[key] = histogram
+    for i, bound in enumerate(BUCKETS):
+        if value <= bound:
+            histogram[i] += 1
+            break
+    histogram[-2] += value
+    histogram[-1] += 1
+
+def event(stage, value):
+    """Count an event of a stage of generation.
+
+    Args:
+        stage: One of pysafeprime.STAGES.
+        value: The value of the event, see pysafeprime.STAGES.
+    """
+
+    name = _EVENTS.get(stage)
+    if name is not None:
+        shard = _shard()
+        _inc(shard, name, (shard.function or 'none',), value if stage == 'sieve_rejected' else 1)
+
+def random_bytes(n):
+    """Count n random bytes drawn from the random source."""
+
+    shard = _shard()
+    _inc(shard, 'pysafeprime_random_bytes_total', (shard.function or 'none',), n)
+
+def worker_thread():
+    """Mark the current thread as a worker of a generator call on another thread.
+
+    Calls on a worker thread count their CPU time, but not a call or a
+    prime, since the generator call they work for counts those.
+    """
+
+    _shard().worker = True
+
+def call(function, k, func, args, kwargs):
+    """Call a generator and record its metrics.
+
+    Only the outermost generator call on a thread is recorded, so the
+    primes that safe_prime draws on its way are not counted as results.
+
+    Args:
+        function: The name of the generator.
+        k: The bit size of the call.
+        func: The generator.
+        args: The positional arguments of func.
+        kwargs: The keyword arguments of func.
+
+    Returns:
+        The result of func(*args, **kwargs).
+    """
+
+    shard = _shard()
+    if shard.function is not None:
+        return func(*args, **kwargs)
+
+    shard.function = function
+    wall = timeit.default_timer()
+    cpu = _thread_time()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        cpu = _thread_time() - cpu
+        wall = timeit.default_timer() - wall
+        shard.function = None
+        _inc(shard, 'pysafeprime_cpu_seconds_total', (function,), cpu)
+        if not shard.worker:
+            labels = (function, str(k))
+            _observe(shard, 'pysafeprime_call_seconds', labels, wall)
+            _observe(shard, 'pysafeprime_call_cpu_seconds', labels, cpu)
+
+    if not shard.worker:
+        _inc(shard, 'pysafeprime_primes_generated_total', (function, str(k)), len(result) if isinstance(result, list) else 1)
+    return result
+
+def _merged():
+    """Sum the shards of every thread.
+
+    Returns:
+        A pair (counters, histograms) of dicts keyed by (name, labels).
+    """
+
+    total = _Shard()
+    with _lock:
+        shards = list(_shards)
+        _fold(total, _retired)
+    for shard in shards:
+        # Copying a dict is atomic under the GIL, so a shard may be read
+        # while its thread goes on recording.
+        copy = _Shard()
+        copy.counters = dict(shard.counters)
+        copy.histograms = dict((key, list(histogram)) for key, histogram in list(shard.histograms.items()))
+        _fold(total, copy)
+    return total.counters, total.histograms
+
+def snapshot():
+    """Take a snapshot of every metric.
+
+    Returns:
+        A dict mapping every metric name to a list of its series. A series
+        is a dict with the labels and, for a counter, the value, or for a
+        histogram, the cumulative bucket counts by upper bound, the sum and the count.
+    """
+
+    counters, histograms = _merged()
+    result = collections.OrderedDict((name, []) for name in METRICS)
+    for (name, labels), value in sorted(counters.items()):
+        result[name].append({'labels': dict(zip(METRICS[name][2], labels)), 'value': value})
+    for (name, labels), histogram in sorted(histograms.items()):
+        cumulative = []
+        total = 0
+        for count in histogram[:len(BUCKETS)]:
+            total += count
+            cumulative.append(total)
+        result[name].append({'labels': dict(zip(METRICS[name][2], labels)),
+            'buckets': collections.OrderedDict(zip(BUCKETS, cumulative)), 'sum': histogram[-2], 'count': histogram[-1]})
+    return result
+
+def _format_labels(labels):
+    return '{%s}' % ','.join('%s="%s"' % (key, labels[key]) for key in sorted(labels))
+
+def _format_bound(bound):
+    return '+Inf' if bound == float('inf') else repr(bound)
+
+def _format_value(value):
+    return repr(value) if isinstance(value, float) else str(value)
+
+def prometheus_text():
+    """Export every metric in the Prometheus text exposition format.
+
+    Returns:
+        The text.
+    """
+
+    lines = []
+    for name, series in snapshot().items():
+        kind, description, label_names = METRICS[name]
+        lines.append('# HELP %s %s' % (name, description))
+        lines.append('# TYPE %s %s' % (name, kind))
+        for entry in series:
+            labels = entry['labels']
+            if kind == 'counter':
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(entry['value'])))
+                continue
+            for bound, count in entry['buckets'].items():
+                bucket_labels = dict(labels, le = _format_bound(bound))
+                lines.append('%s_bucket%s %d' % (name, _format_labels(bucket_labels), count))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(entry['sum'])))
+            lines.append('%s_count%s %d' % (name, _format_labels(labels), entry['count']))
+    return '\n'.join(lines) + '\n'
+
+def reset():
+    """Zero every metric."""
+
+    with _lock:
+        for shard in _shards + [_retired]:
+            shard.counters.clear()
+            shard.histograms.clear()
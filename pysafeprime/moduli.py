@@ -0,0 +1,236 @@
+import bisect
+import collections
+import itertools
+import multiprocessing
+import os
+import time
+
+from . import pysafeprime
+
+# Values of the type field, as in OpenSSH's moduli.c.
+MODULI_TYPE_UNKNOWN = 0
+MODULI_TYPE_UNSTRUCTURED = 1
+MODULI_TYPE_SAFE = 2
+MODULI_TYPE_SCHNORR = 3
+MODULI_TYPE_SOPHIE_GERMAIN = 4
+MODULI_TYPE_STRONG = 5
+
+# Bits of the tests field, as in OpenSSH's moduli.c.
+MODULI_TESTS_UNTESTED = 0x00
+MODULI_TESTS_COMPOSITE = 0x01
+MODULI_TESTS_SIEVE = 0x02
+MODULI_TESTS_MILLER_RABIN = 0x04
+MODULI_TESTS_JACOBI = 0x08
+MODULI_TESTS_ELLIPTIC = 0x10
+
+# One line of a moduli file. The size is the bit length of the modulus minus
+# one, i.e., the index of its most significant bit.
+Modulus = collections.namedtuple('Modulus', ['timestamp', 'type', 'tests', 'trials', 'size', 'generator', 'modulus'])
+
+def format_modulus(entry):
+    """Format a moduli file line.
+
+    Args:
+        entry: The Modulus. A timestamp of None is replaced by the current UTC time.
+
+    Returns:
+        The line, with a trailing newline.
+    """
+
+    timestamp = entry.timestamp or time.strftime('%Y%m%d%H%M%S', time.gmtime())
+    return '%s %u %u %u %u %x %X\n' % (timestamp, entry.type, entry.tests, entry.trials,
+        entry.size, entry.generator, entry.modulus)
+
+def parse_modulus(line):
+    """Parse a moduli file line.
+
+    Args:
+        line: The line.
+
+    Returns:
+        The Modulus, or None if the line is blank or a comment.
+    """
+
+    line = line.strip()
+    if not line or line.startswith('#'):
+        return None
+    fields = line.split()
+    if len(fields) != 7:
+        raise Exception("Malformed moduli line: %s" % line)
+    return Modulus(fields[0], int(fields[1]), int(fields[2]), int(fields[3]), int(fields[4]),
+        int(fields[5], 16), int(fields[6], 16))
+
+def read_moduli(lines):
+    """Parse the moduli in a file.
+
+    Args:
+        lines: An iterable of the lines of the file.
+
+    Returns:
+        A generator of the Modulus of every non-comment line.
+    """
+
+    for line in lines:
+        entry = parse_modulus(line)
+        if entry is not None:
+            yield entry
+
+def generate_candidates(output, bits, windows = 1, window = None, sieve_bound = 2 ** 16, start = None):
+    """Sieve phase: stream Sophie Germain candidates q to a moduli file.
+
+    This is the counterpart of ssh-keygen -M generate. Each window of odd
+    (bits - 1)-bit integers q is sieved jointly for q and 2q + 1 against the
+    odd primes below sieve_bound, and every survivor is written as a line of
+    type MODULI_TYPE_SOPHIE_GERMAIN with tests MODULI_TESTS_SIEVE, ready for
+    screen_candidates. Lines are written and flushed window by window.
+
+    Args:
+        output: The file to write the candidates to.
+        bits: The number of bits in the moduli p = 2q + 1.
+        windows: The number of windows to sieve.
+        window: The number of odd candidates per window. Defaults to 64 * bits.
+        sieve_bound: The (exclusive) bound on the small primes in the sieve.
+        start: The start of the first window, or None for a random start.
+
+    Returns:
+        The number of candidates written.
+    """
+
+    window = window or (64 * bits)
+    primes = pysafeprime._primes_below(sieve_bound)
+    primes = primes[:bisect.bisect_left(primes, 2 ** (bits - 2))]
+    written = 0
+    q0 = start
+    for w in range(windows):
+        pysafeprime._checkpoint()
+        if q0 is None or q0.bit_length() != bits - 1:
+            q0 = pysafeprime._random_bit_integer(bits - 1)
+        q0 |= 1
+        for q in pysafeprime._sieve_survivors(q0, window, primes, bits - 1, True):
+            output.write(format_modulus(Modulus(None, MODULI_TYPE_SOPHIE_GERMAIN, MODULI_TESTS_SIEVE,
+                0, bits - 2, 0, q)))
+            written += 1
+        output.flush()
+        q0 += 2 * window
+    return written
+
+def _generator_for(p):
+    """Pick the generator for a safe prime p the way OpenSSH does.
+
+    Args:
+        p: The safe prime.
+
+    Returns:
+        The generator, or 0 if none of 2, 3 and 5 is chosen.
+    """
+
+    if p % 24 == 11:
+        return 2
+    if p % 12 == 5:
+        return 3
+    if p % 10 == 3 or p % 10 == 7:
+        return 5
+    return 0
+
+def _screen_line(args):
+    """Screen one moduli file line.
+
+    For a Sophie Germain candidate q, or a safe prime p = 2q + 1, p is first
+    put through a base-2 Fermat test, q is then put through trials rounds of
+    Miller-Rabin, and p is finally proven prime by Pocklington's criterion
+    as in fast_safe_prime_2.
+
+    Args:
+        args: A tuple (line, trials).
+
+    Returns:
+        The output line for a safe prime, or None if the line is rejected.
+    """
+
+    line, trials = args
+    entry = parse_modulus(line)
+    if entry is None:
+        return None
+    if entry.type == MODULI_TYPE_SOPHIE_GERMAIN:
+        q = entry.modulus
+        p = (2 * q) + 1
+        size = entry.size + 1
+    elif entry.type == MODULI_TYPE_SAFE:
+        p = entry.modulus
+        q = (p - 1) // 2
+        size = entry.size
+    else:
+        return None
+
+    generator = _generator_for(p)
+    if generator == 0 or q < 5:
+        return None
+    if pysafeprime.get_backend().powmod(2, p - 1, p) != 1 or not pysafeprime.is_prime_rabin(q, trials):
+        return None
+    return format_modulus(Modulus(None, MODULI_TYPE_SAFE, entry.tests | MODULI_TESTS_MILLER_RABIN,
+        trials, size, generator, p))
+
+def _write_checkpoint(checkpoint, lines):
+    """Atomically record the number of input lines that have been screened."""
+
+    temporary = checkpoint + '.tmp'
+    with open(temporary, 'w') as f:
+        f.write('%d\n' % lines)
+    os.rename(temporary, checkpoint)
+
+def _read_checkpoint(checkpoint):
+    """Read the number of input lines already screened, or 0 without a checkpoint."""
+
+    if checkpoint is None or not os.path.exists(checkpoint):
+        return 0
+    with open(checkpoint) as f:
+        return int(f.read().strip() or 0)
+
+def screen_candidates(lines, output, trials = 100, processes = None, checkpoint = None):
+    """Screening phase: test the candidates of a moduli file.
+
+    This is the counterpart of ssh-keygen -M screen. Every input line is
+    screened by _screen_line, and the safe primes found are written in
+    input order as lines of type MODULI_TYPE_SAFE, ready for /etc/ssh/moduli.
+
+    If processes is given, then lines are screened in parallel by a pool of
+    that many processes. If checkpoint names a file, then the number of
+    input lines screened so far is recorded there after every line, and a
+    later call with the same checkpoint skips those lines, so an interrupted
+    screening resumes where it stopped (append to the same output).
+
+    Args:
+        lines: An iterable of the lines of the candidate file.
+        output: The file to write the safe primes to.
+        trials: The number of Miller-Rabin rounds on every q.
+        processes: The number of worker processes, or None to screen in this process.
+        checkpoint: The path of the checkpoint file, or None.
+
+    Returns:
+        The number of safe primes written.
+    """
+
+    done = _read_checkpoint(checkpoint)
+    tasks = ((line, trials) for line in itertools.islice(lines, done, None))
+
+    pool = None
+    if processes:
+        pool = multiprocessing.Pool(processes)
+        results = pool.imap(_screen_line, tasks, 4)
+    else:
+        results = (_screen_line(task) for task in tasks)
+
+    written = 0
+    try:
+        for result in results:
+            if result is not None:
+                output.write(result)
+                output.flush()
+                written += 1
+            done += 1
+            if checkpoint is not None:
+                _write_checkpoint(checkpoint, done)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    return written
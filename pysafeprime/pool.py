@@ -0,0 +1,178 @@
+import collections
+import multiprocessing
+import threading
+
+from . import pysafeprime
+
+# The seconds a refill thread waits after a failed generation, doubling with
+# every failure in a row up to _MAX_RETRY_DELAY.
+_RETRY_DELAY = 0.05
+_MAX_RETRY_DELAY = 5.0
+
+class SafePrimePool(object):
+    """A stock of pre-generated safe primes that refills itself in the background.
+
+    Safe-prime generation has a heavy-tailed latency, so callers on a request
+    path take primes from the stock instead. Whenever the stock drops to
+    low_water primes, background workers generate primes until it is back
+    at target_size. A get() on an empty stock is a miss and generates a prime
+    inline.
+
+    Attributes:
+        k: The number of bits in the primes.
+        target_size: The number of primes the stock is refilled to.
+        low_water: The stock size at which refilling starts.
+        hits: The number of get() calls served from the stock.
+        misses: The number of get() calls that had to generate inline.
+        generated: The number of primes generated by the background workers.
+        errors: The number of background generations that raised an exception.
+        last_error: The last exception raised by a background generation, or None.
+    """
+
+    def __init__(self, k, target_size, low_water, generator = None, workers = 1, processes = None):
+        """Create a pool and start its background workers.
+
+        Args:
+            k: The number of bits in the primes.
+            target_size: The number of primes the stock is refilled to.
+            low_water: The stock size at which refilling starts, below target_size.
+            generator: The module-level function (k) -> prime. Defaults to fast_safe_prime.
+            workers: The number of background refill threads.
+            processes: If given, generate in a pool of that many processes instead
+                of on the refill threads, so refilling never holds the GIL.
+        """
+
+        if not 0 <= low_water < target_size:
+            raise Exception("low_water must be at least 0 and below target_size")
+
+        self.k = k
+        self.target_size = target_size
+        self.low_water = low_water
+        self.hits = 0
+        self.misses = 0
+        self.generated = 0
+        self.errors = 0
+        self.last_error = None
+
+        self._generator = generator or pysafeprime.fast_safe_prime
+        self._primes = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._refilling = True
+        self._in_flight = 0
+        self._stop = threading.Event()
+        self._processes = multiprocessing.Pool(processes) if processes else None
+
+        self._threads = [threading.Thread(target = self._refill) for i in range(max(workers, processes or 0))]
+        for thread in self._threads:
+            thread.daemon = True
+            thread.start()
+
+    def __len__(self):
+        return len(self._primes)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get(self):
+        """Take a prime from the pool.
+
+        Returns:
+            A prime from the stock in O(1) if there is one, else a freshly generated prime.
+        """
+
+        with self._lock:
+            if self._primes:
+                self.hits += 1
+                p = self._primes.popleft()
+            else:
+                self.misses += 1
+                p = None
+            if len(self._primes) <= self.low_water and not self._refilling:
+                self._refilling = True
+                self._wakeup.notify_all()
+        if p is None:
+            p = self._generator(self.k)
+        return p
+
+    def stats(self):
+        """Report the counters of the pool.
+
+        Returns:
+            A dict with the current size, hits, misses, generated count and error count.
+        """
+
+        with self._lock:
+            return {
+                'size': len(self._primes),
+                'hits': self.hits,
+                'misses': self.misses,
+                'generated': self.generated,
+                'errors': self.errors,
+            }
+
+    def close(self):
+        """Stop the background workers and discard any generation in progress."""
+
+        self._stop.set()
+        with self._lock:
+            self._wakeup.notify_all()
+        if self._processes is not None:
+            self._processes.terminate()
+        for thread in self._threads:
+            thread.join()
+
+    def _generate(self):
+        """Generate one prime on this refill thread or in the process pool."""
+
+        if self._processes is not None:
+            result = self._processes.apply_async(self._generator, (self.k,))
+            while not self._stop.is_set():
+                try:
+                    return result.get(pysafeprime._POLL_INTERVAL)
+                except multiprocessing.TimeoutError:
+                    pass
+            raise pysafeprime._SearchCancelled()
+        return self._generator(self.k)
+
+    def _refill(self):
+        """Generate primes whenever the stock is being refilled, until closed.
+
+        A generation that raises is counted in errors, and the thread backs
+        off before it tries again, so a transient failure never stops the refill.
+        """
+
+        with pysafeprime._search_context(pysafeprime._SearchContext(self._stop)):
+            delay = _RETRY_DELAY
+            while True:
+                with self._lock:
+                    while not self._stop.is_set() and not (self._refilling and
+                            len(self._primes) + self._in_flight < self.target_size):
+                        self._wakeup.wait()
+                    if self._stop.is_set():
+                        return
+                    self._in_flight += 1
+                try:
+                    p = self._generate()
+                except pysafeprime._SearchCancelled:
+                    return
+                except Exception as e:
+                    with self._lock:
+                        self.errors += 1
+                        self.last_error = e
+                    self._stop.wait(delay)
+                    delay = min(2 * delay, _MAX_RETRY_DELAY)
+                    continue
+                finally:
+                    with self._lock:
+                        self._in_flight -= 1
+                delay = _RETRY_DELAY
+                with self._lock:
+                    self._primes.append(p)
+                    self.generated += 1
+                    if len(self._primes) >= self.target_size:
+                        self._refilling = False
+                    self._wakeup.notify_all()
@@ -1,7 +1,172 @@
+import bisect
 import sys
 import os
+import functools
 import math
 import struct
+import binascii
+import contextlib
+import itertools
+import multiprocessing
+import threading
+import timeit
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    from math import gcd as _gcd
+except ImportError:
+    from fractions import gcd as _gcd
+
+from . import metrics
+from .backend import get_backend
+
+_timer = timeit.default_timer
+
+def _small_primes(bound):
+    """Compute all odd primes below some bound.
+
+    Use the sieve of Eratosthenes to build the table of small primes that
+    candidates are sieved against.
+
+    Args:
+        bound: The (exclusive) upper bound on the primes.
+
+    Returns:
+        A list of the odd primes less than bound, in increasing order.
+    """
+
+    sieve = bytearray([1]) * bound
+    sieve[0:3] = bytearray(3)
+    for i in range(3, int(math.sqrt(bound)) + 1, 2):
+        if sieve[i]:
+            sieve[i * i::2 * i] = bytearray((bound - 1 - (i * i)) // (2 * i) + 1)
+    return list(itertools.compress(range(3, bound, 2), sieve[3::2]))
+
+def _small_prime_table(bound):
+    """Build a lookup table of the primes below some bound.
+
+    Args:
+        bound: The (exclusive) upper bound on the table.
+
+    Returns:
+        A bytearray in which entry n is nonzero iff n is prime.
+    """
+
+    table = bytearray(bound)
+    table[2] = 1
+    for p in _small_primes(bound):
+        table[p] = 1
+    return table
+
+_SIEVE_BOUND = 2 ** 12
+_SMALL_PRIMES = _small_primes(_SIEVE_BOUND)
+
+def _small_prime_products(primes, bits):
+    """Group small primes into products that fit in a machine word.
+
+    Args:
+        primes: The primes to group, in increasing order.
+        bits: The bound on the bit length of each product.
+
+    Returns:
+        A list of pairs (m, group) where m is the product of the primes in group.
+    """
+
+    products = []
+    m = 1
+    group = []
+    for p in primes:
+        if (m * p).bit_length() > bits:
+            products.append((m, tuple(group)))
+            m = 1
+            group = []
+        m *= p
+        group.append(p)
+    if group:
+        products.append((m, tuple(group)))
+    return products
+
+def _product_tree(values):
+    """Build a product tree over a list of integers.
+
+    Level 0 of the tree holds the values themselves, and every node on the
+    next level is the product of two adjacent nodes (an odd node out is
+    carried up unchanged), up to the single product of all values.
+
+    Args:
+        values: The non-empty list of integers at the leaves.
+
+    Returns:
+        The list of levels of the tree, from the leaves to the root.
+    """
+
+    tree = [list(values)]
+    while len(tree[-1]) > 1:
+        level = tree[-1]
+        tree.append([level[i] * level[i + 1] if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)])
+    return tree
+
+def _remainder_tree(x, tree):
+    """Reduce an integer modulo every leaf of a product tree.
+
+    x is reduced modulo the root, and each remainder is then reduced modulo
+    the two children of its node, so every reduction is by a modulus about
+    the size of the remainder instead of by a tiny leaf.
+
+    Args:
+        x: The integer to reduce.
+        tree: A product tree, as built by _product_tree.
+
+    Returns:
+        The list of x mod v for every leaf v, in the order of the leaves.
+    """
+
+    remainders = [x % tree[-1][0]]
+    for level in reversed(tree[:-1]):
+        remainders = [remainders[i // 2] % v for i, v in enumerate(level)]
+    return remainders
+
+_SMALL_PRIME_TABLE = _small_prime_table(2 ** 16)
+_SMALL_PRIME_PRODUCTS = _small_prime_products(_SMALL_PRIMES, 62)
+_PRIMORIALS = {_SIEVE_BOUND: _product_tree(_SMALL_PRIMES)[-1][0]}
+_SMALL_PRIME_LISTS = {_SIEVE_BOUND: _SMALL_PRIMES}
+
+# Pairs (bound, bases) such that every odd composite n < bound fails a
+# Miller-Rabin round for at least one of the bases, ordered by bound. The
+# last bound exceeds 2^81, so every 64-bit integer is covered. The bases
+# below 2^64 are Sinclair's, some of which are multiples of primes above
+# 2^16, so a base that is 0 modulo n is skipped.
+_DETERMINISTIC_BASES = [
+    (2047, (2,)),
+    (1373653, (2, 3)),
+    (25326001, (2, 3, 5)),
+    (3215031751, (2, 3, 5, 7)),
+    (4759123141, (2, 7, 61)),
+    (2152302898747, (2, 3, 5, 7, 11)),
+    (3474749660383, (2, 3, 5, 7, 11, 13)),
+    (341550071728321, (2, 3, 5, 7, 11, 13, 17)),
+    (2 ** 64, (2, 325, 9375, 28178, 450775, 9780504, 1795265022)),
+    (318665857834031151167461, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37)),
+    (3317044064679887385961981, (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)),
+]
+
+def _draw(num_bytes):
+    """Draw a random integer of num_bytes bytes from the random source.
+
+    The source is os.urandom, unless the search context of the current
+    thread carries another one. The benchmarks set a seeded source there to
+    make their runs repeatable, so no other thread ever draws from it.
+    """
+
+    metrics.random_bytes(num_bytes)
+    context = getattr(_local, 'context', None)
+    random_bytes = context.random_bytes if context is not None and context.random_bytes is not None else os.urandom
+    return int(binascii.hexlify(random_bytes(num_bytes)), 16)
 
 def _random_in_range(low, high):
     """Generate a random integer within some finite range.
@@ -14,10 +179,15 @@ def _random_in_range(low, high):
         A random integer in the range [low, high].
     """
 
-    num_bytes = (int(math.log(high, 2)) / 8) + 1
-    n = int(os.urandom(num_bytes).encode('hex'), 16)
+    # Only draw as many bits as high has, so that at most about half of the
+    # draws fall out of range.
+    bits = high.bit_length()
+    num_bytes = (bits + 7) // 8
+    mask = (1 << bits) - 1
+    n = _draw(num_bytes) & mask
     while n < low or n > high:
-        n = int(os.urandom(num_bytes).encode('hex'), 16)
+        _stage('random_rejected', n)
+        n = _draw(num_bytes) & mask
     return n
 
 def _random_bit_integer(k):
@@ -26,64 +196,1115 @@ def _random_bit_integer(k):
     Args:
         k: The number of bits in the integer.
     Returns:
-        A random k-bit integer.
+        A random k-bit integer greater than 2^(k - 1).
+    """
+
+    # Draw whole bytes, keep the low k bits and set the top one, so that a
+    # draw only misses when it is exactly 2^(k - 1).
+    top = 1 << (k - 1)
+    mask = (1 << k) - 1
+    n = (_draw((k + 7) // 8) & mask) | top
+    while n == top:
+        _stage('random_rejected', n)
+        n = (_draw((k + 7) // 8) & mask) | top
+    return n
+
+def _split_power_of_two(n):
+    """Write a positive integer n as r * 2^s with r odd.
+
+    Args:
+        n: The positive integer to split.
+
+    Returns:
+        The pair (r, s).
+    """
+
+    s = 0
+    while n % 2 == 0:
+        s += 1
+        n //= 2
+    return n, s
+
+def _miller_rabin_round(n, a, r, s, powmod = pow):
+    """Run one round of the Miller-Rabin test with a fixed base.
+
+    This is the inner loop of algorithm 4.24 from the HAC, i.e., a test of
+    whether n is a strong probable prime to the base a.
+
+    Args:
+        n: The odd integer whose primality is in question.
+        a: The base, with 2 <= a <= n - 2.
+        r: The odd part of n - 1.
+        s: The exponent of 2 in n - 1, so that n - 1 = r * 2^s.
+        powmod: The modular exponentiation of the arithmetic backend.
+
+    Returns:
+        True if n is a strong probable prime to the base a, False otherwise.
+    """
+
+    return _miller_rabin_squarings(n, powmod(a, r, n), s, powmod)
+
+def _miller_rabin_squarings(n, y, s, powmod = pow):
+    """Finish one round of the Miller-Rabin test from y = a^r mod n.
+
+    Args:
+        n: The odd integer whose primality is in question.
+        y: The base raised to the odd part of n - 1, modulo n.
+        s: The exponent of 2 in n - 1.
+        powmod: The modular exponentiation of the arithmetic backend.
+
+    Returns:
+        True if n is a strong probable prime to the base, False otherwise.
     """
 
-    low = (2 ** (k - 1)) + 1
-    high = (2 ** k) - 1
-    return _random_in_range(low, high)
+    if y == 1 or y == (n - 1):
+        return True
+    for j in range(s - 1):
+        y = powmod(y, 2, n)
+        if y == (n - 1):
+            return True
+        if y == 1:
+            return False
+    return False
 
-def is_prime_rabin(n, t = 40):
+def is_prime_rabin(n, t = 40, backend = None):
     """Miller-Rabin primality test. 
     
     This code is implemented using algorithm 4.24 from the HAC (http://cacr.uwaterloo.ca/hac/about/chap4.pdf).
 
-    XXX: provide a better explanation of that value
+    A composite n survives each round with a random base with probability
+    at most 1/4, so the default t = 40 bounds the error by 2^-80 for any n.
+    See miller_rabin_rounds for fewer rounds on random inputs.
     
     Args:
         n: The integer whose primality is in question.
         t: The security parameter. 
+        backend: The name of the arithmetic backend, or None for the selected one.
 
     Returns:
         True if n is deemed prime upon t iterations of the core algorithm.
         False otherwise.
     """
 
-    if n == 2:
+    return _run_steps(_rabin_steps(n, t, backend))
+
+def _run_steps(steps):
+    """Drive the steps of a search to completion.
+
+    Args:
+        steps: A generator that yields None after every unit of work, and
+            then its result, see _rabin_steps and _prime_steps.
+
+    Returns:
+        The result, or None if the generator ends without one.
+    """
+
+    for result in steps:
+        if result is not None:
+            return result
+    return None
+
+def _rabin_steps(n, t, backend = None):
+    """Run the Miller-Rabin test of is_prime_rabin one round at a time.
+
+    The time of every round is counted in the GenerationStats of the search
+    on this thread, if any.
+
+    Args:
+        n: The integer whose primality is in question.
+        t: The security parameter.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        A generator that yields None after every round, and then True if n
+        is deemed prime upon t rounds, False otherwise.
+
+    Raises:
+        _SearchCancelled: If the search on this thread was cancelled.
+        GenerationTimeout: If the search on this thread is past its deadline.
+    """
+
+    if n == 2 or n == 3:
+        yield True
+        return
+
+    if n < 2 or n % 2 == 0:
+        yield False
+        return
+
+    arithmetic = get_backend(backend)
+    if arithmetic.is_strong_prp is None:
+        r, s = _split_power_of_two(n - 1)
+    stats = _current_stats()
+    for i in range(t):
+        _checkpoint()
+        start = _timer()
+        a = _random_in_range(2, n - 2)
+        _stage('round', a)
+        if arithmetic.is_strong_prp is not None:
+            passed = arithmetic.is_strong_prp(n, a)
+        else:
+            passed = _miller_rabin_round(n, a, r, s, arithmetic.powmod)
+        if stats is not None:
+            stats.rabin_seconds += _timer() - start
+        yield None
+        if not passed:
+            _stage('round_failed', a)
+            yield False
+            return
+    yield True
+
+def _isqrt(n):
+    """Compute the integer square root of a nonnegative integer.
+
+    Args:
+        n: The nonnegative integer.
+
+    Returns:
+        The largest integer x such that x^2 <= n.
+    """
+
+    if n == 0:
+        return 0
+    x = 1 << ((n.bit_length() + 1) // 2)
+    while True:
+        y = (x + (n // x)) // 2
+        if y >= x:
+            return x
+        x = y
+
+def _jacobi(a, n):
+    """Compute the Jacobi symbol (a / n).
+
+    This code is implemented using algorithm 2.149 from the HAC, unrolled
+    into a loop so that no recursion or factoring is needed.
+
+    Args:
+        a: The integer on top.
+        n: The odd positive integer on the bottom.
+
+    Returns:
+        The Jacobi symbol, one of -1, 0 or 1.
+    """
+
+    a %= n
+    result = 1
+    while a != 0:
+        while a % 2 == 0:
+            a //= 2
+            if n % 8 == 3 or n % 8 == 5:
+                result = -result
+        a, n = n, a
+        if a % 4 == 3 and n % 4 == 3:
+            result = -result
+        a %= n
+    if n == 1:
+        return result
+    return 0
+
+def _is_strong_lucas_prp(n):
+    """Strong Lucas probable prime test with Selfridge's parameters.
+
+    D is the first of 5, -7, 9, -11, ... with Jacobi symbol (D / n) = -1,
+    and the Lucas sequences use P = 1 and Q = (1 - D) / 4. Writing
+    n + 1 = d * 2^s with d odd, n is a strong Lucas probable prime if
+    U_d = 0 mod n or V_(d * 2^r) = 0 mod n for some 0 <= r < s.
+
+    Args:
+        n: The odd integer whose primality is in question, not a perfect square.
+
+    Returns:
+        True if n is a strong Lucas probable prime, False otherwise.
+    """
+
+    D = 5
+    while True:
+        j = _jacobi(D, n)
+        if j == -1:
+            break
+        if j == 0 and abs(D) != n:
+            return False
+        D = -D - 2 if D > 0 else -D + 2
+    P = 1
+    Q = (1 - D) // 4
+
+    d, s = _split_power_of_two(n + 1)
+
+    # Compute U_d and V_d by left-to-right binary expansion of d.
+    U = 1
+    V = P
+    Qk = Q % n
+    for bit in bin(d)[3:]:
+        U = (U * V) % n
+        V = ((V * V) - (2 * Qk)) % n
+        Qk = (Qk * Qk) % n
+        if bit == '1':
+            U, V = (P * U) + V, (D * U) + (P * V)
+            if U % 2 == 1:
+                U += n
+            if V % 2 == 1:
+                V += n
+            U = (U // 2) % n
+            V = (V // 2) % n
+            Qk = (Qk * Q) % n
+
+    if U == 0 or V == 0:
         return True
+    for r in range(s - 1):
+        V = ((V * V) - (2 * Qk)) % n
+        if V == 0:
+            return True
+        Qk = (Qk * Qk) % n
+    return False
+
+def is_prime_bpsw(n, backend = None):
+    """Baillie-PSW primality test.
+
+    One Miller-Rabin round with base 2 followed by a strong Lucas test with
+    Selfridge's parameters. The two tests fail on very different composites,
+    and no composite is known to pass both, yet the whole test costs about
+    as much as three rounds of Miller-Rabin.
+
+    Args:
+        n: The integer whose primality is in question.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        True if n is a Baillie-PSW probable prime, False otherwise.
+    """
 
+    if n < 2:
+        return False
+    for p in _SMALL_PRIMES[:25]:
+        if n % p == 0:
+            return n == p
+    if n == 2:
+        return True
     if n % 2 == 0:
         return False
 
-    nn = n - 1
-    s = 0
-    while nn % 2 == 0:
-        s += 1
-        nn /= 2
-    r = nn
+    arithmetic = get_backend(backend)
+    if arithmetic.is_strong_prp is not None:
+        if not arithmetic.is_strong_prp(n, 2):
+            return False
+    else:
+        r, s = _split_power_of_two(n - 1)
+        if not _miller_rabin_round(n, 2, r, s, arithmetic.powmod):
+            return False
+    if _isqrt(n) ** 2 == n:
+        return False
+    if arithmetic.is_strong_lucas_prp is not None:
+        return arithmetic.is_strong_lucas_prp(n)
+    return _is_strong_lucas_prp(n)
 
-    assert((2 ** s) * r == (n - 1))
+def _log2_rabin_error(k, t):
+    """Bound the error of t Miller-Rabin rounds on a random k-bit integer.
 
-    #num_trials = int(math.log((1 / probability), 4))
-    for i in range(t):
-        a = _random_in_range(2, n - 2)
-        y = pow(a, r, n)
-        if y != 1 and y != (n - 1):
-            j = 1
-            while j <= s - 1 and y != (n - 1):
-                y = pow(y, y, n)
-                if y == 1:
+    This is fact 4.48 from the HAC, due to Damgard, Landrock and Pomerance,
+    which bounds the probability that a random odd k-bit integer declared
+    prime by t rounds with random bases is in fact composite. The same
+    bounds underlie the round counts in FIPS 186-4, appendix C.3.
+
+    Args:
+        k: The number of bits in the integer.
+        t: The number of Miller-Rabin rounds.
+
+    Returns:
+        log2 of the smallest bound that applies to (k, t), or None if no bound applies.
+    """
+
+    bounds = []
+    log_k = math.log(k, 2)
+    if t == 1 and k >= 2:
+        bounds.append((2 * log_k) + (2 * (2 - math.sqrt(k))))
+    if (t == 2 and k >= 88) or (3 <= t <= k / 9.0 and k >= 21):
+        bounds.append((1.5 * log_k) + t - (0.5 * math.log(t, 2)) + (2 * (2 - math.sqrt(t * k))))
+    if k / 9.0 <= t <= k / 4.0 and k >= 21:
+        terms = [math.log(7 / 20.0, 2) + log_k - (5 * t),
+                 math.log(1 / 7.0, 2) + (3.75 * log_k) - (k / 2.0) - (2 * t),
+                 math.log(12, 2) + log_k - (k / 4.0) - (3 * t)]
+        largest = max(terms)
+        bounds.append(largest + math.log(sum(2 ** (term - largest) for term in terms), 2))
+    if t >= k / 4.0 and k >= 21:
+        bounds.append(math.log(1 / 7.0, 2) + (3.75 * log_k) - (k / 2.0) - (2 * t))
+    if not bounds:
+        return None
+    return min(bounds)
+
+def miller_rabin_rounds(k, error = 2 ** -100, adversarial = False):
+    """Compute the number of Miller-Rabin rounds for a target error.
+
+    If the integer under test may have been chosen by an adversary, then the
+    only guarantee is that a composite passes a round with probability at
+    most 1/4 (fact 4.25 in the HAC), so ceil(log4(1 / error)) rounds are
+    needed. If the integer was drawn at random, as it is during prime
+    generation, then the far smaller average-case bounds of fact 4.48 apply
+    and a handful of rounds suffice at 1024 bits and beyond.
+
+    Args:
+        k: The number of bits in the integer under test.
+        error: The target probability that a composite is declared prime.
+        adversarial: A flag to indicate that the integer may not be random.
+
+    Returns:
+        The number of rounds to run.
+    """
+
+    log_error = math.log(error, 2)
+    worst_case = max(1, int(math.ceil(-log_error / 2)))
+    if adversarial:
+        return worst_case
+
+    for t in range(1, worst_case):
+        bound = _log2_rabin_error(k, t)
+        if bound is not None and bound <= log_error:
+            return t
+    return worst_case
+
+def _is_prime_deterministic(n, backend = None):
+    """Deterministic primality test for small integers.
+
+    Integers below 2^16 are looked up in a table. Larger integers are
+    screened against the odd primes of _SMALL_PRIME_PRODUCTS[0], and then get
+    Miller-Rabin with the fixed set of bases from _DETERMINISTIC_BASES that
+    is known to expose every composite below the bound of n, so the answer
+    is exact and no randomness is needed.
+
+    If the arithmetic backend can exponentiate a list of bases at once,
+    then all of the a^r mod n are computed in a single call.
+
+    Args:
+        n: The integer whose primality is in question, below 3317044064679887385961981.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        True if n is prime, False otherwise.
+    """
+
+    if n < len(_SMALL_PRIME_TABLE):
+        return n >= 0 and _SMALL_PRIME_TABLE[n] == 1
+    if n % 2 == 0:
+        return False
+    # One division by the first word-sized product of odd primes rejects
+    # most composites before any exponentiation.
+    m, group = _SMALL_PRIME_PRODUCTS[0]
+    x = n % m
+    for q in group:
+        if x % q == 0:
+            return False
+
+    arithmetic = get_backend(backend)
+    r, s = _split_power_of_two(n - 1)
+    for bound, bases in _DETERMINISTIC_BASES:
+        if n < bound:
+            bases = [a % n for a in bases if a % n != 0]
+            if arithmetic.powmod_base_list is not None:
+                ys = arithmetic.powmod_base_list(bases, r, n)
+                return all(_miller_rabin_squarings(n, y, s, arithmetic.powmod) for y in ys)
+            for a in bases:
+                if not _miller_rabin_round(n, a, r, s, arithmetic.powmod):
                     return False
-                j = j + 1
-            if y != (n - 1):
-                return False
+            return True
+    raise Exception("Integer is too large for the deterministic test")
+
+def _has_small_factor(n):
+    """Check whether an integer has an odd prime factor below _SIEVE_BOUND.
+
+    Trial division by every small prime would cost one multi-precision
+    division per prime. Instead, n is reduced once modulo each word-sized
+    product of small primes, and the remainder is then tested against the
+    primes in that product with machine-size arithmetic.
+
+    Args:
+        n: The integer to check, larger than every prime in the table.
+
+    Returns:
+        True if some odd prime below _SIEVE_BOUND divides n, False otherwise.
+    """
+
+    for m, group in _SMALL_PRIME_PRODUCTS:
+        r = n % m
+        for p in group:
+            if r % p == 0:
+                return True
+    return False
 
-    return True
+def is_prime(p, error = None, adversarial = True, engine = 'rabin', backend = None):
+    """Test whether an integer is prime.
 
-def is_prime(p):
-    return is_prime_rabin(p)
+    By default this runs 40 rounds of Miller-Rabin. If a target error is
+    given, then the number of rounds is chosen by miller_rabin_rounds from
+    the bit length of p instead.
 
-def random_prime_with_filter(k, condition, block = False):
+    If engine = 'bpsw', then the Baillie-PSW test is used instead of
+    Miller-Rabin with random bases, and error and adversarial are ignored.
+
+    Integers below 3.3 * 10^24, which includes every 64-bit integer, are
+    always tested exactly by table lookup or deterministic Miller-Rabin,
+    whatever the engine. Before any exponentiation, the former are screened
+    with a single word-sized division, and larger integers are trial divided
+    by all of the small primes.
+
+    Args:
+        p: The integer whose primality is in question.
+        error: The target probability that a composite is declared prime.
+        adversarial: A flag to indicate that p may not be random.
+        engine: The primality test to use, either 'rabin' or 'bpsw'.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        True if p is (probabilistically) prime, False otherwise.
+    """
+
+    if engine != 'rabin' and engine != 'bpsw':
+        raise Exception("Unknown primality engine: %s" % engine)
+
+    if p < _DETERMINISTIC_BASES[-1][0]:
+        return _is_prime_deterministic(p, backend)
+    if p % 2 == 0 or _has_small_factor(p):
+        return False
+    return _is_prime_engine(p, error, adversarial, engine, backend)
+
+def _is_prime_engine(p, error, adversarial, engine, backend = None):
+    """Run the selected primality engine on an integer.
+
+    Args:
+        p: The integer whose primality is in question, already screened for small factors.
+        error: The target probability that a composite is declared prime.
+        adversarial: A flag to indicate that p may not be random.
+        engine: The primality test to use, either 'rabin' or 'bpsw'.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        True if p is (probabilistically) prime, False otherwise.
+    """
+
+    if engine == 'bpsw':
+        return is_prime_bpsw(p, backend)
+
+    if error is None:
+        return is_prime_rabin(p, backend = backend)
+    return is_prime_rabin(p, miller_rabin_rounds(max(p.bit_length(), 2), error, adversarial), backend)
+
+def _primes_below(bound):
+    """Get all odd primes below some bound, cached per bound.
+
+    Args:
+        bound: The (exclusive) upper bound on the primes.
+
+    Returns:
+        The list of the odd primes less than bound, in increasing order,
+        which must not be modified.
+    """
+
+    if bound not in _SMALL_PRIME_LISTS:
+        _SMALL_PRIME_LISTS[bound] = _small_primes(bound)
+    return _SMALL_PRIME_LISTS[bound]
+
+def _primorial(bound):
+    """Compute the product of all odd primes below some bound.
+
+    The product is built with a product tree, so that it stays cheap for
+    millions of primes, and is cached per bound.
+
+    Args:
+        bound: The (exclusive) upper bound on the primes.
+
+    Returns:
+        The product of the odd primes less than bound.
+    """
+
+    if bound not in _PRIMORIALS:
+        _PRIMORIALS[bound] = _product_tree(_small_primes(bound))[-1][0]
+    return _PRIMORIALS[bound]
+
+def screen_small_factors(values, bound = _SIEVE_BOUND):
+    """Screen a batch of integers for small prime factors.
+
+    This is Bernstein's batch trial division: a product tree is built over
+    the batch, the primorial of the small primes is reduced modulo every
+    integer with a remainder tree, and an integer n has a small factor iff
+    gcd(primorial mod n, n) != 1. The cost is a few multiplications and
+    divisions the size of the whole batch, plus one gcd per integer, rather
+    than one division per integer and small prime, so large bounds (even
+    millions of primes) remain practical. The primorial is cached per bound.
+
+    Args:
+        values: The list of integers to screen, each at least bound.
+        bound: The (exclusive) bound on the small primes.
+
+    Returns:
+        A list with True for every integer that is odd and has no prime
+        factor below bound, and False otherwise, in the order of values.
+    """
+
+    odd = [n for n in values if n % 2 == 1]
+    if not odd:
+        return [False] * len(values)
+    remainders = iter(_remainder_tree(_primorial(bound), _product_tree(odd)))
+    return [n % 2 == 1 and _gcd(next(remainders), n) == 1 for n in values]
+
+def _is_prime_chunk(args):
+    """Test a chunk of integers for primality.
+
+    The large integers in the chunk are screened for small factors together
+    by screen_small_factors, and only the survivors reach the primality
+    engine.
+
+    Args:
+        args: A tuple (values, error, adversarial, engine, sieve_bound, backend) as for is_prime_many.
+
+    Returns:
+        The list of primality results, in the order of values.
+    """
+
+    values, error, adversarial, engine, sieve_bound, backend = args
+    bound = max(_DETERMINISTIC_BASES[-1][0], sieve_bound)
+
+    large = [n for n in values if n >= bound]
+    survivors = set(n for n, survived in zip(large, screen_small_factors(large, sieve_bound)) if survived)
+
+    results = []
+    for n in values:
+        if n < _DETERMINISTIC_BASES[-1][0]:
+            results.append(_is_prime_deterministic(n, backend))
+        elif n < bound:
+            results.append(is_prime(n, error, adversarial, engine, backend))
+        elif n not in survivors:
+            results.append(False)
+        else:
+            results.append(_is_prime_engine(n, error, adversarial, engine, backend))
+    return results
+
+def is_prime_many(values, error = None, adversarial = True, engine = 'rabin', processes = None, chunk_size = 256, sieve_bound = _SIEVE_BOUND, backend = None):
+    """Test many integers for primality.
+
+    The integers are tested in chunks of chunk_size, and the trial division
+    of each chunk is shared through a product tree and a remainder tree
+    (see screen_small_factors). Results are yielded in the order of the input as
+    soon as the chunk they belong to is done, so the input may be an
+    arbitrarily long iterator.
+
+    If processes is given, then chunks are tested in parallel by a pool of
+    that many processes, with at most two chunks per process in flight.
+
+    Args:
+        values: An iterable of the integers whose primality is in question.
+        error: The target probability that a composite is declared prime.
+        adversarial: A flag to indicate that the integers may not be random.
+        engine: The primality test to use, either 'rabin' or 'bpsw'.
+        processes: The number of worker processes, or None to test in this process.
+        chunk_size: The number of integers screened together.
+        sieve_bound: The (exclusive) bound on the small primes screened for.
+        backend: The name of the arithmetic backend, or None for the selected one.
+
+    Returns:
+        A generator of the primality results, in the order of values.
+    """
+
+    if engine != 'rabin' and engine != 'bpsw':
+        raise Exception("Unknown primality engine: %s" % engine)
+
+    values = iter(values)
+    chunks = iter(lambda: list(itertools.islice(values, chunk_size)), [])
+    if backend is None:
+        # Worker processes may not share the selection made in this one.
+        backend = get_backend().name
+    return _is_prime_many(chunks, (error, adversarial, engine, sieve_bound, backend), processes)
+
+def _is_prime_many(chunks, options, processes):
+    """Yield the primality results of is_prime_many chunk by chunk.
+
+    Args:
+        chunks: An iterator of lists of integers.
+        options: The tuple (error, adversarial, engine, sieve_bound, backend).
+        processes: The number of worker processes, or None to test in this process.
+
+    Returns:
+        A generator of the primality results, in order.
+    """
+
+    if not processes:
+        for chunk in chunks:
+            for result in _is_prime_chunk((chunk,) + options):
+                yield result
+        return
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        while True:
+            batch = [(chunk,) + options for chunk in itertools.islice(chunks, 2 * processes)]
+            if not batch:
+                break
+            for results in pool.imap(_is_prime_chunk, batch):
+                for result in results:
+                    yield result
+    finally:
+        pool.terminate()
+
+def _generation_rounds(k, error):
+    """Compute the Miller-Rabin rounds for testing random k-bit candidates.
+
+    Args:
+        k: The number of bits in the candidates.
+        error: The target error probability, or None for the default of 40 rounds.
+
+    Returns:
+        The number of rounds to run.
+    """
+
+    if error is None:
+        return 40
+    return miller_rabin_rounds(k, error)
+
+class _SearchCancelled(Exception):
+    """Raised inside a search that was cancelled because another search won."""
+
+class GenerationTimeout(Exception):
+    """Raised when a generator runs out of the time given by its timeout.
+
+    Attributes:
+        stats: The GenerationStats of the search up to the timeout, with
+            seconds set to the time it ran for. The counters include those of
+            worker threads, but not those of worker processes.
+    """
+
+    def __init__(self, stats):
+        Exception.__init__(self, "Generation timed out after %.3f seconds" % stats.seconds)
+        self.stats = stats
+
+# The stages of generation that hooks can be registered for. Every hook is
+# called as hook(stage, value), where value is:
+#   'start': the pair (function, k) of a generator call that is starting.
+#   'end': the result of that call, or None if it raised.
+#   'window': the tuple (n0, window, bound, safe) of a window a search sieves, where
+#             bound is the largest prime sieved by, or 0.
+#   'candidate': the candidate about to be handed to a primality test.
+#   'random_rejected': an integer drawn out of range by _random_in_range.
+#   'sieve_rejected': the number of candidates the sieve ruled out in a window.
+#   'round': the base of a Miller-Rabin round about to start.
+#   'round_failed': the base of a Miller-Rabin round that proved n composite.
+#   'filter_rejected': a prime rejected by the condition of the search.
+#   'found': the result of a search, including the primes s and t that
+#            safe_prime draws before its own result.
+STAGES = ('start', 'end', 'window', 'candidate', 'random_rejected', 'sieve_rejected', 'round', 'round_failed',
+    'filter_rejected', 'found')
+
+_hooks = {}
+
+def add_hook(stage, hook):
+    """Register a function to be called at a stage of generation.
+
+    Hooks are called on the thread running the search, so they are not
+    called for searches run in worker processes.
+
+    Args:
+        stage: One of STAGES.
+        hook: A function (stage, value) -> None.
+    """
+
+    if stage not in STAGES:
+        raise Exception("Unknown generation stage: %s" % stage)
+    # Replace rather than mutate the tuple, so that searches running on
+    # other threads never see it change under them.
+    _hooks[stage] = _hooks.get(stage, ()) + (hook,)
+
+def remove_hook(stage, hook):
+    """Unregister a function registered with add_hook.
+
+    Args:
+        stage: One of STAGES.
+        hook: The function.
+    """
+
+    hooks = list(_hooks.get(stage, ()))
+    hooks.remove(hook)
+    _hooks[stage] = tuple(hooks)
+
+class GenerationStats(object):
+    """Counters for one call of a generator, returned when it is given stats = True.
+
+    Attributes:
+        candidates: The number of candidates handed to a primality test.
+        random_rejections: The number of random integers drawn out of range and redrawn.
+        sieve_rejections: The number of candidates ruled out by a sieve.
+        rounds: The number of Miller-Rabin rounds run.
+        round_failures: The number of Miller-Rabin rounds that proved a candidate composite.
+        filter_rejections: The number of primes rejected by the condition of the search.
+        rabin_seconds: The time spent in Miller-Rabin rounds, in seconds.
+        seconds: The time spent in the whole call, in seconds.
+    """
+
+    __slots__ = ('candidates', 'random_rejections', 'sieve_rejections', 'rounds', 'round_failures',
+        'filter_rejections', 'rabin_seconds', 'seconds')
+
+    def __init__(self):
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def __repr__(self):
+        return 'GenerationStats(%s)' % ', '.join('%s=%r' % (name, getattr(self, name)) for name in self.__slots__)
+
+    def as_dict(self):
+        """Return the counters as a dict."""
+
+        return dict((name, getattr(self, name)) for name in self.__slots__)
+
+    def add(self, other):
+        """Add the counters of another search, such as a worker thread, to these.
+
+        The seconds of the call are left as they are.
+        """
+
+        for name in self.__slots__:
+            if name != 'seconds':
+                setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def record(self, stage, value):
+        """Count one event of a stage of generation."""
+
+        if stage == 'candidate':
+            self.candidates += 1
+        elif stage == 'random_rejected':
+            self.random_rejections += 1
+        elif stage == 'sieve_rejected':
+            self.sieve_rejections += value
+        elif stage == 'round':
+            self.rounds += 1
+        elif stage == 'round_failed':
+            self.round_failures += 1
+        elif stage == 'filter_rejected':
+            self.filter_rejections += 1
+
+class _SearchContext(object):
+    """The state of the generation running on the current thread.
+
+    Attributes:
+        stop: An Event that is set when the search should be abandoned, or None.
+        stats: The GenerationStats that the events of the search are counted in, or None.
+        deadline: The _timer() value at which the search times out, or None.
+        started: The _timer() value at which the timeout started, or None.
+        random_bytes: The function (n) -> n random bytes of the search, or None for os.urandom.
+        caller: The ident of the thread that this worker thread searches for, or None.
+    """
+
+    __slots__ = ('stop', 'stats', 'deadline', 'started', 'random_bytes', 'caller')
+
+    def __init__(self, stop = None, stats = None, random_bytes = None, caller = None):
+        self.stop = stop
+        self.stats = stats
+        self.deadline = None
+        self.started = None
+        self.random_bytes = random_bytes
+        self.caller = caller
+
+_local = threading.local()
+
+@contextlib.contextmanager
+def _search_context(context):
+    """Run a block with a search context installed on this thread.
+
+    The context that was installed before, if any, is restored afterwards,
+    so an enclosing search on the same thread keeps its own.
+
+    Args:
+        context: The _SearchContext, or None to run without one.
+
+    Returns:
+        A context manager that yields context.
+    """
+
+    previous = getattr(_local, 'context', None)
+    _local.context = context
+    try:
+        yield context
+    finally:
+        _local.context = previous
+
+# Seconds between checkpoints while waiting on parallel searches.
+_POLL_INTERVAL = 0.05
+
+def _checkpoint():
+    """Check whether the search on the current thread should go on.
+
+    Searches call this between sieve windows, _candidate before every
+    candidate and _rabin_steps before every round, so a thread running a
+    search can be cancelled, or time out, within about one Miller-Rabin round.
+
+    Raises:
+        _SearchCancelled: If the search on this thread was cancelled.
+        GenerationTimeout: If the search on this thread is past its deadline.
+    """
+
+    context = getattr(_local, 'context', None)
+    if context is None:
+        return
+    if context.stop is not None and context.stop.is_set():
+        raise _SearchCancelled()
+    if context.deadline is not None:
+        now = _timer()
+        if now >= context.deadline:
+            stats = context.stats if context.stats is not None else GenerationStats()
+            stats.seconds = now - context.started
+            raise GenerationTimeout(stats)
+
+def _stage(stage, value):
+    """Report an event of a stage of generation to the stats, metrics and hooks of this thread.
+
+    Args:
+        stage: One of STAGES.
+        value: The value passed to the hooks, see STAGES.
+    """
+
+    context = getattr(_local, 'context', None)
+    if context is not None and context.stats is not None:
+        context.stats.record(stage, value)
+    metrics.event(stage, value)
+    for hook in _hooks.get(stage, ()):
+        hook(stage, value)
+
+def _candidate(n):
+    """Checkpoint before a candidate is handed to a primality test, and report it.
+
+    Args:
+        n: The candidate.
+
+    Raises:
+        _SearchCancelled: If the search on this thread was cancelled.
+    """
+
+    _checkpoint()
+    _stage('candidate', n)
+
+def _current_stats():
+    """The GenerationStats of the search on this thread, or None."""
+
+    context = getattr(_local, 'context', None)
+    return context.stats if context is not None else None
+
+def _metered(func):
+    """Record the metrics of every call of a generator (k, ...), see metrics.call.
+
+    The call is also reported to the hooks of the 'start' and 'end' stages.
+    """
+
+    @functools.wraps(func)
+    def metered(k, *args, **kwargs):
+        _stage('start', (func.__name__, k))
+        result = None
+        try:
+            result = metrics.call(func.__name__, k, func, (k,) + args, kwargs)
+        finally:
+            _stage('end', result)
+        return result
+
+    return metered
+
+def _with_stats(func, args, workers):
+    """Call a generator while counting its events in a fresh GenerationStats.
+
+    Args:
+        func: The generator.
+        args: The positional arguments of func, without stats.
+        workers: The workers argument of the call.
+
+    Returns:
+        A pair (result, stats).
+    """
+
+    if workers and workers > 1:
+        raise Exception("Stats are only collected for searches on the calling thread")
+
+    context = getattr(_local, 'context', None)
+    if context is None:
+        _local.context = _SearchContext()
+    previous = _local.context.stats
+    stats = GenerationStats()
+    _local.context.stats = stats
+    start = _timer()
+    try:
+        result = func(*args)
+    finally:
+        stats.seconds = _timer() - start
+        if context is None:
+            _local.context = None
+        else:
+            context.stats = previous
+    return result, stats
+
+def _with_timeout(func, args, timeout):
+    """Call a generator that times out after some seconds.
+
+    The deadline holds for every search the call makes on this thread, and
+    an earlier deadline of an enclosing call is kept. Unless stats are
+    already collected, the events of the call are counted in a fresh
+    GenerationStats, so that a timeout can tell how far the search got.
+
+    Args:
+        func: The generator.
+        args: The positional arguments of func, without timeout and stats.
+        timeout: The number of seconds.
+
+    Returns:
+        The result of func(*args).
+
+    Raises:
+        GenerationTimeout: If the call runs out of time.
+    """
+
+    context = getattr(_local, 'context', None)
+    if context is None:
+        _local.context = _SearchContext()
+    current = _local.context
+    previous = (current.stats, current.deadline, current.started)
+    start = _timer()
+    if current.stats is None:
+        current.stats = GenerationStats()
+    if current.deadline is None or start + timeout < current.deadline:
+        current.deadline = start + timeout
+        current.started = start
+    try:
+        return func(*args)
+    finally:
+        if context is None:
+            _local.context = None
+        else:
+            current.stats, current.deadline, current.started = previous
+
+# The number of primes sieved between checkpoints.
+_SIEVE_CHUNK = 4096
+
+def _sieve_window(n0, window, primes, safe = False):
+    """Sieve the odd numbers n0, n0 + 2, ..., n0 + 2(window - 1).
+
+    Every candidate divisible by one of the given primes is marked, so the
+    survivors are the only offsets worth handing to a primality test. The
+    caller must ensure that n0 is larger than every prime in the table.
+    Large tables are sieved _SIEVE_CHUNK primes at a time, with a checkpoint
+    in between.
+
+    If safe = true, then the window is sieved jointly for q and 2q + 1: a
+    candidate q is also marked when q = (r - 1) / 2 mod r, i.e., when 2q + 1
+    is divisible by r.
+
+    Args:
+        n0: The odd start of the window.
+        window: The number of candidates in the window.
+        primes: The odd primes to sieve by.
+        safe: A flag to also sieve out candidates whose 2q + 1 has a small factor.
+
+    Returns:
+        A bytearray in which entry i is nonzero iff n0 + 2i has a small factor.
+    """
+
+    sieve = bytearray(window)
+    for start in range(0, len(primes), _SIEVE_CHUNK):
+        if start:
+            _checkpoint()
+        for r in primes[start:start + _SIEVE_CHUNK]:
+            n0_mod_r = n0 % r
+            inverse_2 = (r + 1) // 2
+            # Solve n0 + 2i = 0 mod r for the first offset i divisible by r.
+            i = ((r - n0_mod_r) * inverse_2) % r
+            if i < window:
+                sieve[i::r] = b'\x01' * ((window - 1 - i) // r + 1)
+            if safe:
+                # Solve n0 + 2i = (r - 1) / 2 mod r, so that r divides 2(n0 + 2i) + 1.
+                i = ((((r - 1) // 2) - n0_mod_r) * inverse_2) % r
+                if i < window:
+                    sieve[i::r] = b'\x01' * ((window - 1 - i) // r + 1)
+    return sieve
+
+def _sieve_survivors(n0, window, primes, k, safe = False):
+    """Sieve a window of odd candidates, and iterate over the survivors.
+
+    This is the window of a search, so it is reported to the 'window' stage
+    before it is sieved, and the number of candidates the sieve ruled out to
+    the 'sieve_rejected' stage. _sieve_window alone reports nothing.
+
+    Args:
+        n0: The odd start of the window.
+        window: The number of candidates in the window.
+        primes: The odd primes to sieve by.
+        k: The number of bits in every candidate.
+        safe: A flag to also sieve out candidates whose 2q + 1 has a small factor.
+
+    Returns:
+        A generator of the survivors n0 + 2i of the sieve, in increasing order,
+        up to the first that is longer than k bits.
+    """
+
+    _stage('window', (n0, window, primes[-1] if primes else 0, safe))
+    sieve = _sieve_window(n0, window, primes, safe)
+    _stage('sieve_rejected', sieve.count(b'\x01'))
+
+    def survivors():
+        for i in range(window):
+            if sieve[i]:
+                continue
+            n = n0 + (2 * i)
+            if n.bit_length() != k:
+                return
+            yield n
+
+    return survivors()
+
+def _prime_steps(k, condition, block, incremental, window, t):
+    """Search for a k-bit prime that satisfies some condition, one step at a time.
+
+    This is the search of random_prime_with_filter. Without incremental,
+    every trial is a fresh random integer. With incremental, this is the
+    incremental search of note 4.51 (ii) in the HAC: one random odd start is
+    drawn per window, the window is sieved against the table of small
+    primes, and only the survivors are handed to Miller-Rabin. Every
+    candidate in the window, sieved or not, counts as one trial.
+
+    Args:
+        k: The number of bits in the prime.
+        condition: The function to filter the prime result.
+        block: A flag to indicate that the iteration bound should not be used.
+        incremental: A flag to enable the sieved incremental search.
+        window: The number of odd candidates per sieve window.
+        t: The number of Miller-Rabin rounds per candidate.
+
+    Returns:
+        A generator that yields None after every sieve window and every
+        Miller-Rabin round, and then the prime.
+
+    Raises:
+        Exception: If the iteration bound was reached.
+    """
+
+    trial = 0
+    num_trials = 100 * k
+    incremental = incremental and 2 ** (k - 1) > _SIEVE_BOUND
+    while trial < num_trials or block:
+        if incremental:
+            _checkpoint()
+            candidates = _sieve_survivors(_random_bit_integer(k) | 1, window, _SMALL_PRIMES, k)
+            yield None
+            trial += window
+        else:
+            candidates = [_random_bit_integer(k)]
+            trial += 1
+
+        for p in candidates:
+            _candidate(p)
+            for passed in _rabin_steps(p, t):
+                if passed is None:
+                    yield None
+            if passed:
+                if condition(p):
+                    _stage('found', p)
+                    yield p
+                    return
+                _stage('filter_rejected', p)
+
+    raise Exception("Could not generate a random prime that meets the criteria")
+
+@_metered
+def random_prime_with_filter(k, condition, block = False, incremental = False, window = None, error = None,
+        timeout = None, stats = False):
     """Return a random k-bit prime that meets some criteria.
 
     Use a condition function to filter the prime result. For example,
@@ -100,26 +1321,43 @@ def random_prime_with_filter(k, condition, block = False):
 
     If block = true, then this will block until it definitely finds a prime. 
 
+    If incremental = true, then rather than drawing a fresh random integer
+    for every trial, a single random odd start is drawn per window of
+    candidates and the window is sieved against all odd primes below
+    _SIEVE_BOUND (algorithm 4.44 with the incremental search of note 4.51).
+    Only the survivors are handed to Miller-Rabin, which removes the vast
+    majority of the exponentiations at large k. Every candidate in the window,
+    sieved or not, counts as one trial.
+
     Args:
         k: The number of bits in the prime.
         condition: The function to filter the prime result.
         block: A flag to indicate that the iteration bound should not be used.
+        incremental: A flag to enable the sieved incremental search.
+        window: The number of odd candidates sieved per random start. Defaults to k.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        timeout: The number of seconds after which to give up, or None to never give up.
+        stats: A flag to also return the GenerationStats of the call.
 
     Returns:
-        An integer n that is (probabilistically) prime and satisfies the given condition.
+        An integer n that is (probabilistically) prime and satisfies the given
+        condition, or the pair (n, stats) if stats = true.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before a prime is found.
     """
 
-    trial = 0
-    num_trials = 100 * k
-    while trial < num_trials or block:
-        p = _random_bit_integer(k)
-        if is_prime_rabin(p) and condition(p):
-            return p
-        trial += 1
+    if stats:
+        return _with_stats(random_prime_with_filter, (k, condition, block, incremental, window, error, timeout), None)
 
-    raise Exception("Could not generate a random prime that meets the criteria")
+    if timeout is not None:
+        return _with_timeout(random_prime_with_filter, (k, condition, block, incremental, window, error), timeout)
+
+    return _run_steps(_prime_steps(k, condition, block, incremental, window or k, _generation_rounds(k, error)))
 
-def random_prime(k, block = False):
+@_metered
+def random_prime(k, block = False, incremental = False, error = None, workers = None, executor = 'auto', timeout = None,
+        stats = False):
     """Generate a random k-bit prime.
 
     Create a random prime according to algorithm 4.44 from the HAC (http://cacr.uwaterloo.ca/hac/about/chap4.pdf).
@@ -128,34 +1366,243 @@ def random_prime(k, block = False):
     Args:
         k: The number of bits in the prime.
         block: A flag to indicate that the iteration bound should not be used.
+        incremental: A flag to enable the sieved incremental search.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        workers: The number of searches to run in parallel. Defaults to searching in this thread.
+        executor: How to run parallel searches: 'thread', 'process' or 'auto'.
+        timeout: The number of seconds after which to give up, or None to never give up.
+        stats: A flag to also return the GenerationStats of the call.
 
     Returns:
-        An integer that is probabilistically prime. 
+        An integer that is probabilistically prime, or the pair (p, stats) if stats = true.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before a prime is found.
     """
-    
-    return random_prime_with_filter(k, lambda p : True, block)
+
+    if stats:
+        return _with_stats(random_prime, (k, block, incremental, error, workers, executor, timeout), workers)
+
+    if timeout is not None:
+        return _with_timeout(random_prime, (k, block, incremental, error, workers, executor), timeout)
+
+    if workers and workers > 1:
+        return _first_result(random_prime, (k, block, incremental, error), workers, executor)
+
+    return random_prime_with_filter(k, lambda p : True, block, incremental, error = error)
 
 
-def safe_prime(k):
+@_metered
+def random_prime_many(k, count, error = None, sieve_bound = _SIEVE_BOUND, batch_size = None, timeout = None):
+    """Generate a list of random k-bit primes.
+
+    Candidates are drawn independently in batches, every batch is screened
+    for prime factors below sieve_bound by screen_small_factors, and only
+    the survivors are handed to Miller-Rabin. A large sieve bound is cheap
+    here since the screening cost is shared by the whole batch.
+
+    Args:
+        k: The number of bits in each prime.
+        count: The number of primes to generate.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        sieve_bound: The (exclusive) bound on the small primes screened for.
+        batch_size: The number of candidates screened together. Defaults to k.
+        timeout: The number of seconds after which to give up, or None to never give up.
+
+    Returns:
+        A list of count integers that are probabilistically prime.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before all primes are found.
+    """
+
+    if timeout is not None:
+        return _with_timeout(random_prime_many, (k, count, error, sieve_bound, batch_size), timeout)
+
+    if 2 ** (k - 1) <= sieve_bound:
+        return [random_prime(k, error = error) for i in range(count)]
+
+    t = _generation_rounds(k, error)
+    batch_size = batch_size or k
+    primes = []
+    while len(primes) < count:
+        _checkpoint()
+        candidates = [_random_bit_integer(k) | 1 for i in range(batch_size)]
+        survivors = screen_small_factors(candidates, sieve_bound)
+        _stage('sieve_rejected', survivors.count(False))
+        for n, survived in zip(candidates, survivors):
+            if not survived:
+                continue
+            _candidate(n)
+            if is_prime_rabin(n, t):
+                primes.append(n)
+    return primes[:count]
+
+def _call(task):
+    """Call a function in a worker process.
+
+    Args:
+        task: A tuple (func, args) of a module-level function and its arguments.
+
+    Returns:
+        The result of func(*args).
+    """
+
+    func, args = task
+    return func(*args)
+
+def threads_run_in_parallel():
+    """Check whether threads can run generation in parallel.
+
+    This is the case on a free-threaded CPython build with the GIL disabled,
+    or when the selected arithmetic backend releases the GIL during its
+    exponentiations, which is where nearly all of the time goes.
+
+    Returns:
+        True if threads give real parallelism, False otherwise.
+    """
+
+    is_gil_enabled = getattr(sys, '_is_gil_enabled', None)
+    if is_gil_enabled is not None and not is_gil_enabled():
+        return True
+    return get_backend().releases_gil
+
+def _first_result_threads(func, args, workers):
+    """Run independent searches on threads and return the first result.
+
+    Every thread runs func(*args) with its own search context. When one of
+    them returns, the stop event of the others is set, and they abandon
+    their search at their next checkpoint. Sieve buffers are allocated per
+    search and os.urandom keeps no state, so the threads share nothing.
+    Once all threads are done, their counters are added to the stats of the
+    calling thread, if any, including when the caller times out.
+
+    Args:
+        func: The search function.
+        args: The arguments of every search.
+        workers: The number of threads.
+
+    Returns:
+        The result of the first search to finish.
+    """
+
+    stop = threading.Event()
+    results = queue.Queue()
+    caller = threading.current_thread().ident
+    stats = _current_stats()
+    worker_stats = [GenerationStats() for i in range(workers)]
+
+    def search(stats):
+        metrics.worker_thread()
+        try:
+            with _search_context(_SearchContext(stop, stats, caller = caller)):
+                results.put((True, func(*args)))
+        except _SearchCancelled:
+            pass
+        except Exception as e:
+            results.put((False, e))
+
+    threads = [threading.Thread(target = search, args = (s,)) for s in worker_stats]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    try:
+        while True:
+            try:
+                succeeded, result = results.get(timeout = _POLL_INTERVAL)
+                break
+            except queue.Empty:
+                _checkpoint()
+    finally:
+        stop.set()
+        for thread in threads:
+            thread.join()
+        if stats is not None:
+            for s in worker_stats:
+                stats.add(s)
+    if not succeeded:
+        raise result
+    return result
+
+def _first_result(func, args, workers, executor = 'process'):
+    """Run independent searches in parallel and return the first result.
+
+    Every one of the workers runs func(*args) as an independent search
+    stream, each with its own random starts. With processes, the pool is
+    terminated as soon as one of them returns, which kills the remaining
+    searches. With threads, the remaining searches are cancelled at their
+    next checkpoint (see _first_result_threads). While waiting, the calling
+    thread keeps passing checkpoints, so cancelling it cancels all workers.
+
+    Args:
+        func: The module-level search function.
+        args: The arguments of every search.
+        workers: The number of workers.
+        executor: 'process', 'thread', or 'auto' to use threads only if
+            threads_run_in_parallel() and processes otherwise.
+
+    Returns:
+        The result of the first search to finish.
+    """
+
+    if executor == 'auto':
+        executor = 'thread' if threads_run_in_parallel() else 'process'
+    if executor == 'thread':
+        return _first_result_threads(func, args, workers)
+    if executor != 'process':
+        raise Exception("Unknown executor: %s" % executor)
+
+    pool = multiprocessing.Pool(workers)
+    try:
+        results = pool.imap_unordered(_call, [(func, args)] * workers)
+        while True:
+            try:
+                return results.next(_POLL_INTERVAL)
+            except multiprocessing.TimeoutError:
+                _checkpoint()
+    finally:
+        pool.terminate()
+
+@_metered
+def safe_prime(k, error = None, workers = None, executor = 'auto', timeout = None, stats = False):
     """Generate a 2k-bit prime using Gordon's algorithm.
 
     Generate a safe prime using algorithm 4.53 from the HAC (http://cacr.uwaterloo.ca/hac/about/chap4.pdf).
 
     Args:
         k: Half the number of bits in the result.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        workers: The number of searches to run in parallel. Defaults to searching in this thread.
+        executor: How to run parallel searches: 'thread', 'process' or 'auto'.
+        timeout: The number of seconds after which to give up, or None to never give up.
+        stats: A flag to also return the GenerationStats of the call.
 
     Returns:
-        A safe prime of length 2k bits that is incorrect with the given probability.
+        A safe prime of length 2k bits that is incorrect with the given probability,
+        or the pair (p, stats) if stats = true.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before a prime is found.
     """
 
-    s = random_prime(k)
-    t = random_prime(k)
+    if stats:
+        return _with_stats(safe_prime, (k, error, workers, executor, timeout), workers)
+
+    if timeout is not None:
+        return _with_timeout(safe_prime, (k, error, workers, executor), timeout)
+
+    if workers and workers > 1:
+        return _first_result(safe_prime, (k, error), workers, executor)
+
+    s = random_prime(k, error = error)
+    t = random_prime(k, error = error)
 
     i = 1
     q = 0
     while q == 0:
         qt = (2 * i * t) + 1
-        if is_prime_rabin(qt):
+        _candidate(qt)
+        if is_prime_rabin(qt, _generation_rounds(qt.bit_length(), error)):
             q = qt
         i += 1
     r = q
@@ -166,43 +1613,186 @@ def safe_prime(k):
     q = 0
     while q == 0:
         qt = p0 + (2 * j * r * s)
-        if is_prime_rabin(qt):
+        _candidate(qt)
+        if is_prime_rabin(qt, _generation_rounds(qt.bit_length(), error)):
             q = qt
         j += 1
     p = q
 
+    _stage('found', p)
     return p
 
-def fast_safe_prime(k):
+def _safe_prime_steps(k, window, t):
+    """Search for a k-bit safe prime with a joint sieve on q and 2q + 1, one step at a time.
+
+    One random odd (k - 1)-bit start q0 is drawn per window, and the window
+    q0, q0 + 2, ... is sieved so that neither q nor 2q + 1 has a factor below
+    _SIEVE_BOUND. Miller-Rabin is only run on the survivors, first on q and
+    then, if q passes, on p = 2q + 1.
+
+    Args:
+        k: The number of bits in the safe prime.
+        window: The number of odd candidates q per sieve window.
+        t: The number of Miller-Rabin rounds per candidate.
+
+    Returns:
+        A generator that yields None after every sieve window and every
+        Miller-Rabin round, and then a safe prime p = 2q + 1 of length k bits.
+    """
+
+    # Primes no larger than q0 can never equal q or 2q + 1.
+    primes = [r for r in _SMALL_PRIMES if r < 2 ** (k - 2)]
+    while True:
+        _checkpoint()
+        candidates = _sieve_survivors(_random_bit_integer(k - 1) | 1, window, primes, k - 1, True)
+        yield None
+        for q in candidates:
+            _candidate(q)
+            for passed in _rabin_steps(q, t):
+                if passed is None:
+                    yield None
+            if not passed:
+                continue
+            p = (2 * q) + 1
+            for passed in _rabin_steps(p, t):
+                if passed is None:
+                    yield None
+            if passed:
+                _stage('found', p)
+                yield p
+                return
+
+@_metered
+def fast_safe_prime(k, window = None, error = None, workers = None, executor = 'auto', timeout = None, stats = False):
     """ Quickly generate a k-bit safe prime.
 
     Quickly generate safe primes using the method of:
         https://eprint.iacr.org/2003/175.pdf
     This function will block until it finds a suitable prime.
 
+    Candidates q are drawn by incremental search and sieved jointly for q and
+    2q + 1, so that almost every candidate whose partner has a small factor
+    is rejected before any modular exponentiation.
+
     Args:
         k: The number of bits in the result.
+        window: The number of odd candidates sieved per random start. Defaults to k.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        workers: The number of searches to run in parallel. Defaults to searching in this thread.
+        executor: How to run parallel searches: 'thread', 'process' or 'auto'.
+        timeout: The number of seconds after which to give up, or None to never give up.
+        stats: A flag to also return the GenerationStats of the call.
 
     Returns: 
-        A safe prime of length k bits that is incorrect with the given probability.
+        A safe prime of length k bits that is incorrect with the given probability,
+        or the pair (p, stats) if stats = true.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before a prime is found.
     """
-    prime_filter = lambda p : p % 4 == 3
 
-    while True:
-        p = random_prime_with_filter(k, prime_filter)
-        
-        if is_prime_rabin((2 * p) + 1): 
-            return p
+    if stats:
+        return _with_stats(fast_safe_prime, (k, window, error, workers, executor, timeout), workers)
+
+    if timeout is not None:
+        return _with_timeout(fast_safe_prime, (k, window, error, workers, executor), timeout)
+
+    if workers and workers > 1:
+        return _first_result(fast_safe_prime, (k, window, error), workers, executor)
 
-def fast_safe_prime_2(k):
+    return _run_steps(_safe_prime_steps(k, window or k, _generation_rounds(k - 1, error)))
+
+@_metered
+def fast_safe_prime_2(k, sieve_bound = 2 ** 16, window = None, error = None, workers = None, executor = 'auto',
+        timeout = None, stats = False):
     """Quickly generate a safe prime.
 
     Use the algorithm outlined in https://eprint.iacr.org/2003/186.pdf.
 
+    Candidates q are sieved jointly for q and 2q + 1 against all odd primes
+    below sieve_bound. Each survivor is then put through the cheapest tests
+    first: a base-2 Fermat test on q, then a base-2 Fermat test on p = 2q + 1,
+    and only then the full Miller-Rabin test on q. Once q is prime, p is
+    proven prime by Pocklington's criterion, since 2^(p - 1) = 1 mod p and
+    gcd(2^2 - 1, p) = 1, so p itself never needs Miller-Rabin.
+
+    A larger sieve bound removes more candidates before any exponentiation
+    at the cost of a longer sieve per window, so it pays off at larger k.
+
     Args:
         k: The number of bits in the result.
+        sieve_bound: The (exclusive) bound on the small primes in the sieve.
+        window: The number of odd candidates sieved per random start. Defaults to 8k.
+        error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        workers: The number of searches to run in parallel. Defaults to searching in this thread.
+        executor: How to run parallel searches: 'thread', 'process' or 'auto'.
+        timeout: The number of seconds after which to give up, or None to never give up.
+        stats: A flag to also return the GenerationStats of the call.
 
     Returns: 
-        A safe prime of length k bits that is incorrect with the given probability.
+        A safe prime of length k bits that is incorrect with the given probability,
+        or the pair (p, stats) if stats = true.
+
+    Raises:
+        GenerationTimeout: If the timeout runs out before a prime is found.
+    """
+
+    if stats:
+        return _with_stats(fast_safe_prime_2, (k, sieve_bound, window, error, workers, executor, timeout), workers)
+
+    if timeout is not None:
+        return _with_timeout(fast_safe_prime_2, (k, sieve_bound, window, error, workers, executor), timeout)
+
+    if workers and workers > 1:
+        return _first_result(fast_safe_prime_2, (k, sieve_bound, window, error), workers, executor)
+
+    return _run_steps(_safe_prime_2_steps(k, sieve_bound, window or (8 * k), _generation_rounds(k - 1, error)))
+
+def _safe_prime_2_steps(k, sieve_bound, window, t):
+    """Search for a k-bit safe prime with Wiener's method, one step at a time.
+
+    This is the search of fast_safe_prime_2: a joint sieve on q and 2q + 1
+    against the odd primes below sieve_bound, then base-2 Fermat tests on q
+    and p = 2q + 1, and Miller-Rabin on q last.
+
+    Args:
+        k: The number of bits in the safe prime.
+        sieve_bound: The (exclusive) bound on the small primes in the sieve.
+        window: The number of odd candidates q per sieve window.
+        t: The number of Miller-Rabin rounds on q.
+
+    Returns:
+        A generator that yields None after every sieve window, every Fermat
+        test and every Miller-Rabin round, and then a safe prime p = 2q + 1
+        of length k bits.
     """
-    pass
+
+    powmod = get_backend().powmod
+    primes = _primes_below(sieve_bound)
+    # Primes no larger than q0 can never equal q or 2q + 1.
+    primes = primes[:bisect.bisect_left(primes, 2 ** (k - 2))]
+    while True:
+        _checkpoint()
+        candidates = _sieve_survivors(_random_bit_integer(k - 1) | 1, window, primes, k - 1, True)
+        yield None
+        for q in candidates:
+            _candidate(q)
+            p = (2 * q) + 1
+            if q > 3:
+                passed = powmod(2, q - 1, q) == 1
+                yield None
+                if not passed:
+                    continue
+            if p % 3 == 0:
+                continue
+            passed = powmod(2, p - 1, p) == 1
+            yield None
+            if not passed:
+                continue
+            for passed in _rabin_steps(q, t):
+                if passed is None:
+                    yield None
+            if passed:
+                _stage('found', p)
+                yield p
+                return
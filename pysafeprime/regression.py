@@ -0,0 +1,119 @@
+import json
+import platform
+import random
+
+from . import bench
+from . import pysafeprime
+
+def machine():
+    """Describe the machine and build that benchmark times depend on.
+
+    Returns:
+        A dict of the host name, processor, Python implementation and version,
+        and arithmetic backend.
+    """
+
+    return {
+        'node': platform.node(),
+        'machine': platform.machine(),
+        'processor': platform.processor(),
+        'python': '%s %s' % (platform.python_implementation(), platform.python_version()),
+        'backend': pysafeprime.get_backend().name,
+    }
+
+def _median(values):
+    ordered = sorted(values)
+    middle = len(ordered) // 2
+    if len(ordered) % 2:
+        return ordered[middle]
+    return (ordered[middle - 1] + ordered[middle]) / 2.0
+
+def bootstrap_interval(baseline, current, resamples = 2000, confidence = 0.95, seed = 0):
+    """Bootstrap a confidence interval on the slowdown of current over baseline.
+
+    Runs with the same seed test the same candidates, so sample i of the
+    baseline and sample i of the current run did the same work, and their
+    ratio measures the slowdown alone. The pairs are resampled with
+    replacement, and the median of the ratios is taken every time, since a
+    single stalled call would drag a mean along with it.
+
+    Args:
+        baseline: The baseline times.
+        current: The current times, paired with the baseline times.
+        resamples: The number of bootstrap resamples.
+        confidence: The confidence level of the interval.
+        seed: The seed of the resampling, so that a comparison is repeatable.
+
+    Returns:
+        A pair (low, high) bounding the median slowdown.
+    """
+
+    pairs = [(b / a) if a > 0 else float('inf') for a, b in zip(baseline, current)]
+    generator = random.Random(seed)
+    medians = sorted(_median([generator.choice(pairs) for x in pairs]) for i in range(resamples))
+    tail = (1 - confidence) / 2
+    return medians[int(tail * (resamples - 1))], medians[int((1 - tail) * (resamples - 1))]
+
+def record_baseline(path, names = None, sizes = None, samples = 100, seed = 0):
+    """Run the benchmark suite and store every sample as a baseline.
+
+    Args:
+        path: The path of the baseline JSON file.
+        names: The benchmarks to run. Defaults to all of bench.BENCHMARKS.
+        sizes: The bit sizes. Defaults to bench.SIZES.
+        samples: The number of timed calls per benchmark and size.
+        seed: The seed of the random bytes.
+
+    Returns:
+        The baseline, as written.
+    """
+
+    results = []
+    for name in (names or list(bench.BENCHMARKS)):
+        for k in (sizes or bench.SIZES):
+            times, candidates = bench.measure(name, k, samples, seed)
+            results.append({'benchmark': name, 'bits': k, 'times': times, 'candidates': candidates})
+
+    baseline = {'machine': machine(), 'samples': samples, 'seed': seed, 'results': results}
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent = 1, sort_keys = True)
+    return baseline
+
+def compare(path, tolerance = 0.05, confidence = 0.95, resamples = 2000):
+    """Re-run the benchmarks of a baseline and flag significant slowdowns.
+
+    Every benchmark and bit size in the baseline is re-run with the same
+    number of samples and the same seed, so the same candidates are tested.
+    A result is a regression when the whole confidence interval on its
+    slowdown lies above 1 + tolerance.
+
+    Args:
+        path: The path of the baseline JSON file, as written by record_baseline.
+        tolerance: The relative slowdown that is never flagged.
+        confidence: The confidence level of the bootstrap intervals.
+        resamples: The number of bootstrap resamples.
+
+    Returns:
+        A generator of one dict per benchmark and bit size, with the baseline
+        and current median times, the median slowdown and its interval (low,
+        high), the ratio of the candidates tested, and whether the result regressed.
+    """
+
+    with open(path) as f:
+        baseline = json.load(f)
+
+    for entry in baseline['results']:
+        times, candidates = bench.measure(entry['benchmark'], entry['bits'], baseline['samples'], baseline['seed'])
+        low, high = bootstrap_interval(entry['times'], times, resamples, confidence)
+        baseline_candidates = sum(entry['candidates'])
+        yield {
+            'benchmark': entry['benchmark'],
+            'bits': entry['bits'],
+            'baseline': _median(entry['times']),
+            'current': _median(times),
+            'ratio': _median([(b / a) if a > 0 else float('inf') for a, b in zip(entry['times'], times)]),
+            'low': low,
+            'high': high,
+            'candidates_ratio': (float(sum(candidates)) / baseline_candidates) if baseline_candidates else None,
+            'regressed': low > 1 + tolerance,
+        }
@@ -0,0 +1,167 @@
+from . import pysafeprime
+
+class _SteppedSearch(object):
+    """A search that runs a bounded amount of work at a time.
+
+    Subclasses implement _steps, which returns one of the generators that
+    random_prime_with_filter and fast_safe_prime drive to completion: it
+    yields None after every unit of work, and the result once it is found.
+
+    Attributes:
+        stats: The GenerationStats of every step so far, with seconds set to
+            the time spent in step.
+        result: The result, or None until it is found.
+    """
+
+    def __init__(self):
+        self.stats = pysafeprime.GenerationStats()
+        self.result = None
+        self._failure = None
+        self._generator = self._steps()
+
+    @property
+    def done(self):
+        """True once the result is found."""
+
+        return self.result is not None
+
+    def step(self, budget = 1):
+        """Advance the search by at most budget units of work.
+
+        A unit of work is the sieve of one window or one Miller-Rabin round,
+        so a step never runs much longer than budget rounds. The search runs
+        on the calling thread, with no threads or processes.
+
+        Args:
+            budget: The number of units of work.
+
+        Returns:
+            The result, or None if it is not found yet.
+
+        Raises:
+            Exception: If the search gives up, on this and every later step.
+        """
+
+        if self._failure is not None:
+            raise self._failure
+        if self.result is not None:
+            return self.result
+
+        context = getattr(pysafeprime._local, 'context', None)
+        # Inherit the cancellation, deadline and random source of an
+        # enclosing search, but count the events of this one on its own.
+        inner = pysafeprime._SearchContext(stats = self.stats)
+        if context is not None:
+            inner.stop = context.stop
+            inner.deadline = context.deadline
+            inner.started = context.started
+            inner.random_bytes = context.random_bytes
+            inner.caller = context.caller
+        start = pysafeprime._timer()
+        try:
+            with pysafeprime._search_context(inner):
+                for i in range(budget):
+                    result = next(self._generator)
+                    if result is not None:
+                        self.result = result
+                        break
+        except Exception as e:
+            self._failure = e
+            raise
+        finally:
+            self.stats.seconds += pysafeprime._timer() - start
+        return self.result
+
+    def run(self):
+        """Step the search until it finds its result.
+
+        Returns:
+            The result.
+        """
+
+        while self.result is None:
+            self.step(64)
+        return self.result
+
+class PrimeSearch(_SteppedSearch):
+    """The search of random_prime_with_filter, run step by step.
+
+    Attributes:
+        k: The number of bits in the prime.
+    """
+
+    def __init__(self, k, condition = None, block = False, incremental = False, window = None, error = None):
+        """Set up a search. No work is done until the first step.
+
+        Args:
+            k: The number of bits in the prime.
+            condition: The function to filter the prime result. Defaults to accepting every prime.
+            block: A flag to indicate that the iteration bound should not be used.
+            incremental: A flag to enable the sieved incremental search.
+            window: The number of odd candidates sieved per random start. Defaults to k.
+            error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        """
+
+        self.k = k
+        self._condition = condition or (lambda p : True)
+        self._block = block
+        self._incremental = incremental
+        self._window = window or k
+        self._t = pysafeprime._generation_rounds(k, error)
+        _SteppedSearch.__init__(self)
+
+    def _steps(self):
+        return pysafeprime._prime_steps(self.k, self._condition, self._block, self._incremental, self._window,
+            self._t)
+
+class SafePrimeSearch(_SteppedSearch):
+    """The search of fast_safe_prime, run step by step.
+
+    Attributes:
+        k: The number of bits in the safe prime.
+    """
+
+    def __init__(self, k, window = None, error = None):
+        """Set up a search. No work is done until the first step.
+
+        Args:
+            k: The number of bits in the safe prime.
+            window: The number of odd candidates sieved per random start. Defaults to k.
+            error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        """
+
+        self.k = k
+        self._window = window or k
+        self._t = pysafeprime._generation_rounds(k - 1, error)
+        _SteppedSearch.__init__(self)
+
+    def _steps(self):
+        return pysafeprime._safe_prime_steps(self.k, self._window, self._t)
+
+class SafePrimeSearch2(_SteppedSearch):
+    """The search of fast_safe_prime_2, run step by step.
+
+    A base-2 Fermat test counts as one unit of work, like a Miller-Rabin round.
+
+    Attributes:
+        k: The number of bits in the safe prime.
+    """
+
+    def __init__(self, k, sieve_bound = 2 ** 16, window = None, error = None):
+        """Set up a search. No work is done until the first step.
+
+        Args:
+            k: The number of bits in the safe prime.
+            sieve_bound: The (exclusive) bound on the small primes in the sieve.
+            window: The number of odd candidates sieved per random start. Defaults to 8k.
+            error: The target error probability, used to pick the Miller-Rabin rounds. Defaults to 40 rounds.
+        """
+
+        self.k = k
+        self._sieve_bound = sieve_bound
+        self._window = window or (8 * k)
+        self._t = pysafeprime._generation_rounds(k - 1, error)
+        _SteppedSearch.__init__(self)
+
+    def _steps(self):
+        return pysafeprime._safe_prime_2_steps(self.k, self._sieve_bound, self._window, self._t)
@@ -0,0 +1,174 @@
+import binascii
+import mmap
+import os
+import random
+import struct
+
+# The store begins with a header of the magic, the format version and the
+# number of sections, followed by one table entry per section: the bit size,
+# the number of primes, and the file offset of the section. A section holds
+# its primes back to back, each as a big-endian integer of (bits + 7) // 8
+# bytes, so the i-th prime of a size is found without reading any other.
+_MAGIC = b'PSPSTORE'
+_VERSION = 1
+_HEADER = struct.Struct('<8sII')
+_ENTRY = struct.Struct('<IIQ')
+
+_random = random.SystemRandom()
+
+def _width(bits):
+    """The number of bytes a prime of some bit size is stored in."""
+
+    return (bits + 7) // 8
+
+def write_store(path, primes):
+    """Write primes to a store file.
+
+    The store is written to a temporary file that then replaces path, so
+    readers that have the old store mapped are never affected.
+
+    Args:
+        path: The path of the store.
+        primes: An iterable of the primes to store.
+
+    Returns:
+        A dict mapping each bit size to the number of primes stored of that size.
+    """
+
+    sections = {}
+    for p in primes:
+        sections.setdefault(p.bit_length(), []).append(p)
+    sizes = sorted(sections)
+
+    offset = _HEADER.size + (len(sizes) * _ENTRY.size)
+    table = []
+    for bits in sizes:
+        table.append(_ENTRY.pack(bits, len(sections[bits]), offset))
+        offset += len(sections[bits]) * _width(bits)
+
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, len(sizes)))
+        for entry in table:
+            f.write(entry)
+        for bits in sizes:
+            digits = 2 * _width(bits)
+            for p in sections[bits]:
+                f.write(binascii.unhexlify('%0*x' % (digits, p)))
+    os.rename(temporary, path)
+    return dict((bits, len(sections[bits])) for bits in sizes)
+
+class PrimeStore(object):
+    """A read-only, memory-mapped view of a store file.
+
+    Only the header and section table are parsed when the store is opened.
+    Primes are read straight from the mapping on demand, and every process
+    mapping the same file shares its pages.
+    """
+
+    def __init__(self, path):
+        """Open and map a store file.
+
+        Args:
+            path: The path of the store, as written by write_store.
+
+        Raises:
+            Exception: If the file is not a store.
+        """
+
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access = mmap.ACCESS_READ)
+
+        magic, version, num_sections = _HEADER.unpack_from(self._map, 0)
+        if magic != _MAGIC or version != _VERSION:
+            self._map.close()
+            raise Exception("Not a prime store: %s" % path)
+
+        self._sections = {}
+        for i in range(num_sections):
+            bits, count, offset = _ENTRY.unpack_from(self._map, _HEADER.size + (i * _ENTRY.size))
+            self._sections[bits] = (count, offset)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return sum(count for count, offset in self._sections.values())
+
+    def close(self):
+        """Unmap the store."""
+
+        self._map.close()
+
+    def sizes(self):
+        """List the bit sizes in the store.
+
+        Returns:
+            The sorted list of the bit sizes with at least one prime.
+        """
+
+        return sorted(self._sections)
+
+    def count(self, bits):
+        """Count the primes of some bit size.
+
+        Args:
+            bits: The bit size.
+
+        Returns:
+            The number of stored primes of that size.
+        """
+
+        return self._sections.get(bits, (0, 0))[0]
+
+    def get(self, bits, index):
+        """Read one prime of some bit size.
+
+        Args:
+            bits: The bit size.
+            index: The index of the prime within its size, from 0.
+
+        Returns:
+            The prime.
+        """
+
+        count, offset = self._sections.get(bits, (0, 0))
+        if not 0 <= index < count:
+            raise IndexError("No prime %d of %d bits in the store" % (index, bits))
+        width = _width(bits)
+        start = offset + (index * width)
+        return int(binascii.hexlify(self._map[start:start + width]), 16)
+
+    def random(self, bits):
+        """Pick a stored prime of some bit size uniformly at random, in O(1).
+
+        Args:
+            bits: The bit size.
+
+        Returns:
+            The prime.
+
+        Raises:
+            Exception: If there is no prime of that size in the store.
+        """
+
+        count = self.count(bits)
+        if count == 0:
+            raise Exception("No primes of %d bits in the store" % bits)
+        return self.get(bits, _random.randrange(count))
+
+    def primes(self, bits):
+        """Iterate over the primes of some bit size.
+
+        Args:
+            bits: The bit size.
+
+        Returns:
+            A generator of the stored primes of that size, in stored order.
+        """
+
+        for index in range(self.count(bits)):
+            yield self.get(bits, index)
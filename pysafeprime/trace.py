@@ -0,0 +1,476 @@
+import binascii
+import collections
+import struct
+import threading
+import time
+import timeit
+
+from . import bench
+from . import pysafeprime
+
+# A trace starts with a header of the magic and the format version, and then
+# holds one block of records per generation run:
+#   RUN: tag, name length, k, start time, elapsed microseconds, completed
+#        flag, number of searching threads, followed by the name of the generator.
+#   WINDOW: tag, start offset, sieve microseconds, window, bound, safe flag,
+#        length of n0, followed by the start n0 of the window.
+#   CANDIDATE: tag, start offset, index of its window among the WINDOW
+#        records of the run, offset i of n = n0 + 2i in the window, rounds,
+#        outcome, microseconds spent on the candidate.
+#   VALUE: like CANDIDATE, for a candidate drawn outside of any window,
+#        followed by the candidate itself in place of the window and offset.
+#   END: tag.
+# Offsets are microseconds since the start of the run. The searches draw
+# their randomness from os.urandom, so the start of every window is kept in
+# place of a seed; together with the offsets it gives back every candidate.
+# Every WINDOW record of a run comes before its candidates.
+_MAGIC = b'PSPTRACE'
+_VERSION = 2
+_HEADER = struct.Struct('<8sI')
+_RUN = struct.Struct('<BHIdQBH')
+_WINDOW = struct.Struct('<BQQIIBH')
+_CANDIDATE = struct.Struct('<BQIIHBI')
+_VALUE = struct.Struct('<BQHHBI')
+_END = struct.Struct('<B')
+_TAG_RUN, _TAG_WINDOW, _TAG_CANDIDATE, _TAG_VALUE, _TAG_END = range(1, 6)
+
+# The outcome of a candidate.
+FOUND = 0
+COMPOSITE = 1
+REJECTED = 2
+FILTERED = 3
+PASSED = 4
+CANCELLED = 5
+
+Run = collections.namedtuple('Run', ['function', 'k', 'started', 'elapsed', 'completed', 'threads', 'windows',
+    'candidates'])
+Window = collections.namedtuple('Window', ['at', 'sieve', 'n0', 'window', 'bound', 'safe'])
+# A candidate n, with the index of its window in Run.windows, or -1.
+Candidate = collections.namedtuple('Candidate', ['at', 'n', 'window', 'rounds', 'outcome', 'elapsed'])
+
+def _to_bytes(n):
+    digits = '%x' % n
+    return binascii.unhexlify(('0' * (len(digits) % 2)) + digits)
+
+def _from_bytes(data):
+    return int(binascii.hexlify(data), 16) if data else 0
+
+class _Recording(object):
+    """A run being recorded, shared by the calling thread and its worker threads."""
+
+    def __init__(self, function, k):
+        self.function = function
+        self.k = k
+        self.started = time.time()
+        self.start = timeit.default_timer()
+        self.workers = 0
+        self.windows = []
+        self.candidates = []
+        # The value reported found for each candidate closed as FOUND, by index.
+        self.found = {}
+        self.lock = threading.Lock()
+
+    def now(self):
+        return int((timeit.default_timer() - self.start) * 1e6)
+
+    def add_window(self, window):
+        with self.lock:
+            self.windows.append(window)
+            return len(self.windows) - 1
+
+class _Cursor(object):
+    """The part of a run that one thread is recording.
+
+    Attributes:
+        run: The _Recording.
+        owner: True on the thread whose generator call started the run.
+        depth: The number of generator calls open on the thread.
+        window: The index of the last window the thread sieved, or -1.
+        window_start: The start offset of that window while it is being sieved, or None.
+        candidate: The candidate being tested, as a list [at, n, window, rounds], or None.
+    """
+
+    def __init__(self, run, owner):
+        self.run = run
+        self.owner = owner
+        self.depth = 1
+        self.window = -1
+        self.window_start = None
+        self.candidate = None
+
+    def close_candidate(self, outcome = None, found = None):
+        candidate = self.candidate
+        if candidate is None:
+            return
+        at, n, window, rounds = candidate
+        if outcome is None:
+            outcome = PASSED if rounds else REJECTED
+        run = self.run
+        with run.lock:
+            if found is not None:
+                run.found[len(run.candidates)] = found
+            run.candidates.append(Candidate(at, n, window, rounds, outcome, run.now() - at))
+        self.candidate = None
+
+class TraceRecorder(object):
+    """Record a binary trace of every generation run while it is open.
+
+    The recorder hooks every stage of generation and appends every run to
+    the trace file in one block once its outermost generator call returns.
+    The worker threads of a call with workers are recorded as part of the
+    run of their caller. Searches run in worker processes are not recorded.
+    """
+
+    def __init__(self, path):
+        """Open a trace file, appending to it if it exists, and start recording.
+
+        Args:
+            path: The path of the trace.
+        """
+
+        self._file = open(path, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(_HEADER.pack(_MAGIC, _VERSION))
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # The run recorded on, or for, every thread with an open generator call.
+        self._runs = {}
+        for stage in pysafeprime.STAGES:
+            pysafeprime.add_hook(stage, self._hook)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Stop recording and close the trace file."""
+
+        for stage in pysafeprime.STAGES:
+            pysafeprime.remove_hook(stage, self._hook)
+        with self._lock:
+            self._file.close()
+
+    def _begin(self, function, k):
+        context = getattr(pysafeprime._local, 'context', None)
+        caller = context.caller if context is not None else None
+        with self._lock:
+            run = self._runs.get(caller) if caller is not None else None
+            cursor = _Cursor(run or _Recording(function, k), run is None)
+            if run is not None:
+                run.workers += 1
+            self._runs[threading.current_thread().ident] = cursor.run
+        self._local.cursor = cursor
+
+    def _hook(self, stage, value):
+        cursor = getattr(self._local, 'cursor', None)
+        if stage == 'start':
+            if cursor is None:
+                self._begin(*value)
+            else:
+                cursor.depth += 1
+            return
+        if cursor is None:
+            return
+
+        run = cursor.run
+        if stage == 'end':
+            cursor.depth -= 1
+            if cursor.depth == 0:
+                # A call that raised was cancelled, or ran out of time.
+                cursor.close_candidate(None if value is not None else CANCELLED)
+                self._local.cursor = None
+                with self._lock:
+                    del self._runs[threading.current_thread().ident]
+                if cursor.owner:
+                    self._write(run, value)
+        elif stage == 'window':
+            cursor.close_candidate()
+            cursor.window_start = run.now()
+            n0, window, bound, safe = value
+            cursor.window = run.add_window([cursor.window_start, 0, n0, window, bound, safe])
+        elif stage == 'sieve_rejected':
+            if cursor.window_start is not None:
+                run.windows[cursor.window][1] = run.now() - cursor.window_start
+                cursor.window_start = None
+        elif stage == 'candidate':
+            cursor.close_candidate()
+            window = cursor.window
+            if window >= 0:
+                n0, size = run.windows[window][2], run.windows[window][3]
+                if not 0 <= value - n0 < 2 * size:
+                    window = -1
+            cursor.candidate = [run.now(), value, window, 0]
+        elif cursor.candidate is not None:
+            if stage == 'round':
+                cursor.candidate[3] += 1
+            elif stage == 'round_failed':
+                cursor.close_candidate(COMPOSITE)
+            elif stage == 'filter_rejected':
+                cursor.close_candidate(FILTERED)
+            elif stage == 'found':
+                cursor.close_candidate(FOUND, value)
+
+    def _write(self, run, result):
+        name = run.function.encode('ascii')
+        with run.lock:
+            windows = list(run.windows)
+            candidates = list(run.candidates)
+            # Only the candidate of the returned result was found. Those of
+            # losing workers, and the primes that safe_prime draws on its
+            # way, passed every test too.
+            for index, value in run.found.items():
+                if value != result:
+                    candidates[index] = candidates[index]._replace(outcome = PASSED)
+        chunks = [_RUN.pack(_TAG_RUN, len(name), run.k, run.started, run.now(), result is not None,
+            run.workers or 1), name]
+        for at, sieve, n0, size, bound, safe in windows:
+            start = _to_bytes(n0)
+            chunks.append(_WINDOW.pack(_TAG_WINDOW, at, sieve, size, bound, safe, len(start)))
+            chunks.append(start)
+        for candidate in candidates:
+            elapsed = min(candidate.elapsed, 2 ** 32 - 1)
+            if candidate.window >= 0:
+                offset = (candidate.n - windows[candidate.window][2]) // 2
+                chunks.append(_CANDIDATE.pack(_TAG_CANDIDATE, candidate.at, candidate.window, offset,
+                    candidate.rounds, candidate.outcome, elapsed))
+            else:
+                value = _to_bytes(candidate.n)
+                chunks.append(_VALUE.pack(_TAG_VALUE, candidate.at, len(value), candidate.rounds,
+                    candidate.outcome, elapsed))
+                chunks.append(value)
+        chunks.append(_END.pack(_TAG_END))
+        with self._lock:
+            if not self._file.closed:
+                self._file.write(b''.join(chunks))
+                self._file.flush()
+
+def read_trace(path):
+    """Read the runs of a trace file.
+
+    Args:
+        path: The path of the trace.
+
+    Returns:
+        A generator of a Run per recorded run, with its windows and its
+        candidates in order, and its times in seconds.
+    """
+
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise Exception("Not a search trace: %s" % path)
+
+    position = _HEADER.size
+    while position < len(data):
+        tag, length, k, started, elapsed, completed, threads = _RUN.unpack_from(data, position)
+        if tag != _TAG_RUN:
+            raise Exception("Corrupt search trace at byte %d" % position)
+        position += _RUN.size
+        function = data[position:position + length].decode('ascii')
+        position += length
+        windows = []
+        candidates = []
+        while True:
+            tag = struct.unpack_from('<B', data, position)[0]
+            if tag == _TAG_END:
+                position += _END.size
+                break
+            if tag == _TAG_WINDOW:
+                tag, at, sieve, window, bound, safe, length = _WINDOW.unpack_from(data, position)
+                position += _WINDOW.size
+                n0 = _from_bytes(data[position:position + length])
+                position += length
+                windows.append(Window(at / 1e6, sieve / 1e6, n0, window, bound, bool(safe)))
+            elif tag == _TAG_CANDIDATE:
+                tag, at, window, offset, rounds, outcome, spent = _CANDIDATE.unpack_from(data, position)
+                position += _CANDIDATE.size
+                n = windows[window].n0 + (2 * offset)
+                candidates.append(Candidate(at / 1e6, n, window, rounds, outcome, spent / 1e6))
+            elif tag == _TAG_VALUE:
+                tag, at, length, rounds, outcome, spent = _VALUE.unpack_from(data, position)
+                position += _VALUE.size
+                n = _from_bytes(data[position:position + length])
+                position += length
+                candidates.append(Candidate(at / 1e6, n, -1, rounds, outcome, spent / 1e6))
+            else:
+                raise Exception("Corrupt search trace at byte %d" % position)
+        yield Run(function, k, started, elapsed / 1e6, bool(completed), threads, windows, candidates)
+
+def summarize(runs):
+    """Compute the distributions of the runs of each generator and bit size.
+
+    Args:
+        runs: An iterable of Run.
+
+    Returns:
+        A list of dicts, one per generator and bit size, with the number of
+        runs, the p50, p90 and p99 of the run times, and the means of the
+        windows, candidates and rounds per run, of the sieve time per window
+        and of the time per round, and the candidates of each outcome.
+    """
+
+    groups = collections.OrderedDict()
+    for run in runs:
+        groups.setdefault((run.function, run.k), []).append(run)
+
+    results = []
+    for (function, k), group in groups.items():
+        times = sorted(run.elapsed for run in group)
+        candidates = [c for run in group for c in run.candidates]
+        windows = [w for run in group for w in run.windows]
+        rounds = sum(c.rounds for c in candidates)
+        outcomes = collections.Counter(c.outcome for c in candidates)
+        results.append({
+            'function': function,
+            'bits': k,
+            'runs': len(group),
+            'completed': sum(1 for run in group if run.completed),
+            'threads_per_run': float(sum(run.threads for run in group)) / len(group),
+            'p50': bench.percentile(times, 50),
+            'p90': bench.percentile(times, 90),
+            'p99': bench.percentile(times, 99),
+            'windows_per_run': float(len(windows)) / len(group),
+            'candidates_per_run': float(len(candidates)) / len(group),
+            'rounds_per_run': float(rounds) / len(group),
+            'sieve_seconds_per_window': (sum(w.sieve for w in windows) / len(windows)) if windows else None,
+            'seconds_per_round': _round_cost(candidates),
+            'outcomes': {
+                'found': outcomes[FOUND],
+                'composite': outcomes[COMPOSITE],
+                'rejected': outcomes[REJECTED],
+                'filtered': outcomes[FILTERED],
+                'passed': outcomes[PASSED],
+                'cancelled': outcomes[CANCELLED],
+            },
+        })
+    return results
+
+def _round_cost(candidates):
+    """Estimate the time of one Miller-Rabin round from the candidates that ran rounds."""
+
+    rounds = sum(c.rounds for c in candidates)
+    if rounds == 0:
+        return None
+    return sum(c.elapsed for c in candidates if c.rounds) / rounds
+
+def _reject_cost(candidates):
+    """Estimate the time to reject a composite that the sieve let through."""
+
+    rejected = [c.elapsed for c in candidates if c.outcome == REJECTED or (c.outcome == COMPOSITE and c.rounds <= 1)]
+    if not rejected:
+        return _round_cost(candidates) or 0.0
+    return sum(rejected) / len(rejected)
+
+# The number of full Miller-Rabin tests run on the result of each generator.
+_PHASES = {'fast_safe_prime': 2}
+
+def _has_factor(n, primes, safe):
+    for r in primes:
+        if n % r == 0 or (safe and ((2 * n) + 1) % r == 0):
+            return n != r
+    return False
+
+def simulate(run, sieve_bound = None, rounds = None):
+    """Estimate the time a run would have taken with other settings.
+
+    No exponentiation is redone. With a larger sieve bound, the recorded
+    candidates that a prime between the two bounds would have sieved out
+    are dropped with their recorded time. With a smaller one, the window is
+    sieved again, and every candidate that only the dropped primes ruled
+    out costs the mean time of rejecting a composite. The sieve time of
+    every window scales with the number of sieving primes. With another
+    number of rounds, every full Miller-Rabin test of t rounds, found by
+    the rounds run on the result, costs the difference at the mean time of
+    a round. The time saved or added is shared by the threads of the run.
+
+    Args:
+        run: The Run.
+        sieve_bound: The (exclusive) sieve bound to simulate, or None to keep the recorded one.
+        rounds: The number of Miller-Rabin rounds to simulate, or None to keep the recorded one.
+
+    Returns:
+        The estimated time of the run, in seconds.
+    """
+
+    elapsed = 0.0
+    round_cost = _round_cost(run.candidates) or 0.0
+
+    if rounds is not None:
+        found = [c for c in run.candidates if c.outcome == FOUND]
+        if found and found[-1].rounds:
+            t = max(found[-1].rounds // _PHASES.get(run.function, 1), 1)
+            for c in run.candidates:
+                passed = c.outcome in (FOUND, PASSED, CANCELLED)
+                # A composite took the rounds of every test it passed, and at least one more.
+                phases = (c.rounds // t) if passed else (max(c.rounds - 1, 0) // t)
+                elapsed += phases * (rounds - t) * round_cost
+
+    if sieve_bound is not None and run.windows:
+        reject_cost = _reject_cost(run.candidates)
+        primes = pysafeprime._small_primes(sieve_bound)
+        recorded = {}
+        by_window = collections.defaultdict(list)
+        for c in run.candidates:
+            if c.window >= 0:
+                by_window[c.window].append(c)
+
+        for index, window in enumerate(run.windows):
+            if window.bound not in recorded:
+                recorded[window.bound] = pysafeprime._small_primes(window.bound + 1) if window.bound else []
+            old = recorded[window.bound]
+            new = [r for r in primes if r < window.n0]
+            if old:
+                elapsed += window.sieve * ((float(len(new)) / len(old)) - 1)
+            tested = by_window.get(index, [])
+            if len(new) > len(old):
+                extra = new[len(old):]
+                for c in tested:
+                    if c.outcome != FOUND and _has_factor(c.n, extra, window.safe):
+                        elapsed -= c.elapsed
+            elif len(new) < len(old):
+                # Only the part of the window that the search got through
+                # before it found the result, or was cancelled.
+                scanned = window.window
+                if tested and tested[-1].outcome in (FOUND, CANCELLED):
+                    scanned = ((tested[-1].n - window.n0) // 2) + 1
+                before = pysafeprime._sieve_window(window.n0, scanned, old, window.safe)
+                after = pysafeprime._sieve_window(window.n0, scanned, new, window.safe)
+                elapsed += sum(1 for i in range(scanned) if before[i] and not after[i]) * reject_cost
+
+    return max(run.elapsed + (elapsed / run.threads), 0.0)
+
+def simulate_runs(runs, sieve_bound = None, rounds = None):
+    """Compare the recorded run times with those simulated by simulate.
+
+    Args:
+        runs: An iterable of Run.
+        sieve_bound: The sieve bound to simulate, or None.
+        rounds: The number of Miller-Rabin rounds to simulate, or None.
+
+    Returns:
+        A list of dicts, one per generator and bit size, with the p50, p90
+        and p99 of the recorded and of the simulated run times, and their means.
+    """
+
+    groups = collections.OrderedDict()
+    for run in runs:
+        groups.setdefault((run.function, run.k), []).append((run.elapsed, simulate(run, sieve_bound, rounds)))
+
+    results = []
+    for (function, k), pairs in groups.items():
+        recorded = sorted(a for a, b in pairs)
+        simulated = sorted(b for a, b in pairs)
+        result = {'function': function, 'bits': k, 'runs': len(pairs),
+            'sieve_bound': sieve_bound, 'rounds': rounds}
+        for name, times in (('recorded', recorded), ('simulated', simulated)):
+            result[name] = {
+                'p50': bench.percentile(times, 50),
+                'p90': bench.percentile(times, 90),
+                'p99': bench.percentile(times, 99),
+                'mean': sum(times) / len(times),
+            }
+        results.append(result)
+    return results
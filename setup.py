@@ -8,4 +8,8 @@ setup(name='pysafeprime',
       author_email='chris@caw.fyi',
       license='MIT',
       packages=['pysafeprime'],
+      extras_require={
+          'gmpy2': ['gmpy2'],
+          'flint': ['python-flint'],
+      },
       zip_safe=False)
@@ -1,20 +1,156 @@
 from nose.tools import *
+from nose.plugins.skip import SkipTest
 
+import contextlib
+import itertools
+import json
 import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
 
 import pysafeprime
+from pysafeprime import get_backend
+from pysafeprime import set_backend
 from pysafeprime import is_prime
+from pysafeprime import is_prime_bpsw
+from pysafeprime import is_prime_many
 from pysafeprime import random_prime
+from pysafeprime import random_prime_many
+from pysafeprime import screen_small_factors
 from pysafeprime import safe_prime
+from pysafeprime import fast_safe_prime
+from pysafeprime import fast_safe_prime_2
+from pysafeprime import miller_rabin_rounds
+from pysafeprime import threads_run_in_parallel
+from pysafeprime import SafePrimePool
 
 def bit_length(n):
     return int(math.log(n, 2)) + 1
 
+@contextlib.contextmanager
+def temporary_directory():
+    directory = tempfile.mkdtemp()
+    try:
+        yield directory
+    finally:
+        shutil.rmtree(directory)
+
 def test_is_prime_small():
     assert is_prime(15) == False
     assert is_prime(23) == True
     assert is_prime(2) == True
 
+def test_is_prime_deterministic():
+    primes = set(p for p in range(2, 2 ** 17) if all(p % d for d in range(2, int(math.sqrt(p)) + 1)))
+    for n in range(-2, 2 ** 17):
+        assert is_prime(n) == (n in primes)
+    # Strong pseudoprimes to the first few prime bases.
+    for n in [2047, 1373653, 25326001, 3215031751, 4759123141, 2152302898747, 3474749660383,
+            341550071728321, 3825123056546413051, 318665857834031151167461]:
+        assert is_prime(n) == False
+    # Primes that divide one of the bases below 2^64.
+    assert is_prime(407521) == True
+    assert is_prime(299210837) == True
+    assert is_prime(2 ** 61 - 1) == True
+    assert is_prime(2 ** 64 - 59) == True
+    assert is_prime(2 ** 64 + 13) == True
+
+def test_is_prime_small_factor():
+    p = 2 ** 61 - 1
+    for r in [3, 47, 53]:
+        assert is_prime(r * p) == False
+    p = 2 ** 127 - 1
+    for r in [2, 3, 5, 4093, 4099]:
+        assert is_prime(r * p) == False
+        assert is_prime(r * p, engine = 'bpsw') == False
+
+def test_is_prime_many():
+    p = 2 ** 127 - 1
+    values = list(range(-3, 200)) + [p, 3 * p, 4099 * p, 2 ** 128, p * (2 ** 89 - 1), 2 ** 89 - 1]
+    expected = [is_prime(n) for n in values]
+    assert list(is_prime_many(values, chunk_size = 7)) == expected
+    assert list(is_prime_many(iter(values), engine = 'bpsw')) == expected
+    assert list(is_prime_many(values, error = 2 ** -100, processes = 2, chunk_size = 16)) == expected
+    assert list(is_prime_many([])) == []
+
+def test_screen_small_factors():
+    p = 2 ** 127 - 1
+    values = [p, 2 * p, 3 * p, 65521 * p, 65537 * p, p * p, 2 ** 130 + 1]
+    assert screen_small_factors(values) == [True, False, False, True, True, True, False]
+    assert screen_small_factors(values, 2 ** 17) == [True, False, False, False, False, True, False]
+    assert screen_small_factors([2 ** 130]) == [False]
+
+def test_is_prime_error():
+    assert is_prime(2 ** 127 - 1, error = 2 ** -100) == True
+    assert is_prime((2 ** 61 - 1) * (2 ** 89 - 1), error = 2 ** -100) == False
+    assert is_prime(13, error = 2 ** -128, adversarial = False) == True
+
+def test_is_prime_bpsw():
+    primes = [2, 3, 5, 23, 7919, 2 ** 127 - 1, 2 ** 521 - 1]
+    # Strong pseudoprimes to base 2, and strong Lucas pseudoprimes.
+    composites = [1, 15, 2047, 3215031751, 3825123056546413051, 5459, 5777, 10877,
+        (2 ** 61 - 1) * (2 ** 89 - 1), (2 ** 127 - 1) ** 2]
+    for p in primes:
+        assert is_prime_bpsw(p) == True
+        assert is_prime(p, engine = 'bpsw') == True
+    for n in composites:
+        assert is_prime_bpsw(n) == False
+        assert is_prime(n, engine = 'bpsw') == False
+
+def test_python_backend():
+    assert get_backend('python').name == 'python'
+    p = 2 ** 127 - 1
+    for n, expected in [(p, True), (p * (2 ** 89 - 1), False), (3825123056546413051, False), (2 ** 64 - 59, True)]:
+        assert is_prime(n, backend = 'python') == expected
+        assert is_prime(n, engine = 'bpsw', backend = 'python') == expected
+    assert list(is_prime_many([p, p + 2], backend = 'python')) == [True, False]
+
+def test_gmpy2_backend():
+    try:
+        get_backend('gmpy2')
+    except Exception:
+        raise SkipTest('gmpy2 is not installed')
+    p = 2 ** 127 - 1
+    for n, expected in [(p, True), (p * (2 ** 89 - 1), False), (3825123056546413051, False), (2 ** 64 - 59, True)]:
+        assert is_prime(n, backend = 'gmpy2') == expected
+        assert is_prime(n, engine = 'bpsw', backend = 'gmpy2') == expected
+
+def test_set_backend():
+    previous = get_backend()
+    try:
+        assert set_backend('python').name == 'python'
+        assert get_backend().name == 'python'
+        p = fast_safe_prime_2(128)
+        check_safe_prime(p)
+    finally:
+        set_backend(previous.name)
+
+def test_unknown_backend():
+    assert_raises(Exception, get_backend, 'nonexistent')
+
+def test_miller_rabin_rounds():
+    # Table 4.4 of the HAC, for an error of at most 2^-80.
+    table = [(100, 27), (150, 18), (200, 15), (250, 12), (300, 9), (350, 8),
+        (400, 7), (450, 6), (550, 5), (650, 4), (850, 3), (1300, 2)]
+    for k, t in table:
+        assert miller_rabin_rounds(k, 2 ** -80) == t
+    assert miller_rabin_rounds(2048, 2 ** -128, adversarial = True) == 64
+
+def test_random_draws():
+    # A k-bit draw takes whole bytes, without an extra byte when k is a multiple of 8.
+    draws = []
+    context = pysafeprime.pysafeprime._SearchContext(random_bytes = lambda n : draws.append(n) or b'\xff' * n)
+    with pysafeprime.pysafeprime._search_context(context):
+        assert pysafeprime.pysafeprime._random_bit_integer(512) == 2 ** 512 - 1
+        assert pysafeprime.pysafeprime._random_bit_integer(509) == 2 ** 509 - 1
+        assert pysafeprime.pysafeprime._random_in_range(2, 2 ** 16 - 1) == 2 ** 16 - 1
+    assert draws == [64, 64, 2]
+
 def test_random_prime_512():
     p = random_prime(512)
     assert bit_length(p) == 512
@@ -23,6 +159,23 @@ def test_random_prime_1024():
     p = random_prime(1024)
     assert bit_length(p) == 1024
 
+def test_random_prime_incremental_1024():
+    p = random_prime(1024, incremental = True)
+    assert bit_length(p) == 1024
+    assert is_prime(p)
+
+def test_random_prime_error_1024():
+    p = random_prime(1024, incremental = True, error = 2 ** -100)
+    assert bit_length(p) == 1024
+    assert is_prime(p)
+
+def test_random_prime_many_512():
+    primes = random_prime_many(512, 3, sieve_bound = 2 ** 16)
+    assert len(primes) == 3
+    for p in primes:
+        assert bit_length(p) == 512
+        assert is_prime(p)
+
 #def test_random_prime_2048():
 #    p = random_prime(2048)
 #    assert bit_length(p) == 2048
@@ -33,11 +186,498 @@ def test_random_prime_1024():
 
 def check_safe_prime(p):
     assert is_prime(p)
-    assert is_prime((p - 1) / 2)
+    assert is_prime((p - 1) // 2)
 
 def test_safe_prime_512():
+    # Gordon's algorithm gives a strong prime of at least 2k bits, and not
+    # a safe prime, so (p - 1) / 2 is not checked.
     p = safe_prime(512)
+    assert bit_length(p) >= 1024
+    assert is_prime(p)
+
+def test_fast_safe_prime_512():
+    p = fast_safe_prime(512)
+    assert bit_length(p) == 512
+    check_safe_prime(p)
+
+def test_fast_safe_prime_small():
+    for k in range(3, 16):
+        p = fast_safe_prime(k)
+        assert bit_length(p) == k
+        check_safe_prime(p)
+
+def test_fast_safe_prime_2_512():
+    p = fast_safe_prime_2(512)
+    assert bit_length(p) == 512
+    check_safe_prime(p)
+
+def test_fast_safe_prime_2_small():
+    for k in range(3, 16):
+        p = fast_safe_prime_2(k, sieve_bound = 256, window = 8)
+        assert bit_length(p) == k
+        check_safe_prime(p)
+
+def test_fast_safe_prime_workers_256():
+    p = fast_safe_prime(256, workers = 2)
+    assert bit_length(p) == 256
+    check_safe_prime(p)
+    p = fast_safe_prime_2(256, workers = 2)
+    assert bit_length(p) == 256
+    check_safe_prime(p)
+
+def test_thread_executor_256():
+    p = fast_safe_prime(256, workers = 3, executor = 'thread')
+    assert bit_length(p) == 256
+    check_safe_prime(p)
+    p = fast_safe_prime_2(256, workers = 3, executor = 'thread')
+    assert bit_length(p) == 256
+    check_safe_prime(p)
+    p = random_prime(256, incremental = True, workers = 3, executor = 'thread')
+    assert bit_length(p) == 256
+    assert is_prime(p)
+
+def test_auto_executor_256():
+    assert threads_run_in_parallel() in (True, False)
+    p = random_prime(256, workers = 2)
+    assert bit_length(p) == 256
+    assert is_prime(p)
+    assert_raises(Exception, random_prime, 256, workers = 2, executor = 'fibers')
+
+def _wait_for(condition):
+    for i in range(600):
+        if condition():
+            return True
+        time.sleep(0.1)
+    return False
+
+def test_safe_prime_pool():
+    with SafePrimePool(64, 4, 1) as pool:
+        assert _wait_for(lambda : len(pool) == 4)
+        primes = [pool.get() for i in range(3)]
+        for p in primes:
+            assert bit_length(p) == 64
+            check_safe_prime(p)
+        assert pool.stats()['hits'] == 3
+        # Dropping to the low-water mark refills the stock to the target.
+        assert _wait_for(lambda : len(pool) == 4)
+        assert pool.stats()['generated'] == 7
+
+    with SafePrimePool(64, 2, 0, generator = pysafeprime.random_prime, workers = 0) as pool:
+        p = pool.get()
+        assert is_prime(p)
+        assert pool.stats()['misses'] == 1
+
+def test_safe_prime_pool_errors():
+    calls = []
+
+    def flaky(k):
+        calls.append(k)
+        if len(calls) % 2 == 1:
+            raise RuntimeError("transient failure")
+        return fast_safe_prime(k)
+
+    with SafePrimePool(64, 3, 1, generator = flaky) as pool:
+        assert _wait_for(lambda : len(pool) == 3)
+        stats = pool.stats()
+        assert stats['generated'] == 3 and stats['errors'] >= 2
+        assert isinstance(pool.last_error, RuntimeError)
+        pool.get()
+        pool.get()
+        assert _wait_for(lambda : len(pool) == 3)
+        assert pool.stats()['misses'] == 0
+
+def test_safe_prime_pool_processes():
+    with SafePrimePool(64, 2, 0, processes = 2) as pool:
+        assert _wait_for(lambda : len(pool) == 2)
+        check_safe_prime(pool.get())
+
+def test_generation_stats():
+    p, stats = fast_safe_prime(128, stats = True)
     check_safe_prime(p)
+    assert stats.candidates >= 1 and stats.sieve_rejections > 0
+    # The winning candidate runs every round on both q and p.
+    assert stats.rounds >= 80 and stats.round_failures == stats.candidates - 1
+    assert 0 < stats.rabin_seconds <= stats.seconds
+
+    rejected = []
+    def condition(p):
+        rejected.append(p)
+        return len(rejected) > 2
+    p, stats = pysafeprime.pysafeprime.random_prime_with_filter(128, condition, incremental = True, stats = True)
+    assert p == rejected[-1] and stats.filter_rejections == 2
+
+    p, stats = safe_prime(32, stats = True)
+    assert stats.candidates >= 3 and stats.as_dict()['candidates'] == stats.candidates
+    assert_raises(Exception, random_prime, 128, workers = 2, stats = True)
+
+def test_generation_hooks():
+    events = []
+    hook = lambda stage, value : events.append((stage, value))
+    for stage in pysafeprime.pysafeprime.STAGES:
+        pysafeprime.add_hook(stage, hook)
+    try:
+        # Sieving outside of a search reports nothing.
+        pysafeprime.pysafeprime._sieve_window(2 ** 64 + 1, 64, pysafeprime.pysafeprime._SMALL_PRIMES, True)
+        assert events == []
+        p = fast_safe_prime(64)
+    finally:
+        for stage in pysafeprime.pysafeprime.STAGES:
+            pysafeprime.remove_hook(stage, hook)
+    assert events[0] == ('start', ('fast_safe_prime', 64))
+    assert events[-2:] == [('found', p), ('end', p)]
+    assert ('candidate', (p - 1) // 2) in events
+    assert set(stage for stage, value in events) >= set(['window', 'candidate', 'sieve_rejected', 'round', 'found'])
+    count = len(events)
+    fast_safe_prime(64)
+    assert len(events) == count
+    assert_raises(Exception, pysafeprime.add_hook, 'nonexistent', hook)
+
+def test_generation_timeout():
+    for func, k in ((fast_safe_prime, 2048), (fast_safe_prime_2, 2048), (safe_prime, 1024), (random_prime, 4096)):
+        try:
+            func(k, timeout = 0.05)
+            assert False
+        except pysafeprime.GenerationTimeout as e:
+            assert isinstance(e.stats, pysafeprime.GenerationStats)
+            assert e.stats.seconds >= 0.05
+    # A large sieve is cached across calls, and checkpointed while it runs.
+    for i in range(2):
+        try:
+            fast_safe_prime_2(2048, sieve_bound = 2 ** 22, timeout = 0.05)
+            assert False
+        except pysafeprime.GenerationTimeout as e:
+            assert e.stats.seconds >= 0.05
+    assert 2 ** 22 in pysafeprime.pysafeprime._SMALL_PRIME_LISTS
+    # The counters of worker threads are added to those of the caller.
+    try:
+        fast_safe_prime(2048, workers = 2, executor = 'thread', timeout = 0.2)
+        assert False
+    except pysafeprime.GenerationTimeout as e:
+        assert e.stats.candidates > 0 and e.stats.rounds > 0
+    p, stats = fast_safe_prime(64, timeout = 60, stats = True)
+    assert is_prime(p) and is_prime((p - 1) // 2) and stats.candidates > 0
+    assert is_prime(random_prime(64, timeout = 60))
+    assert pysafeprime.pysafeprime._local.context is None
+
+def test_stepwise_search():
+    search = pysafeprime.SafePrimeSearch(128)
+    steps = 0
+    while search.step(4) is None:
+        assert search.stats.rounds <= 4 * (steps + 1)
+        steps += 1
+    p = search.result
+    assert search.done and search.step() == p
+    assert is_prime(p) and is_prime((p - 1) // 2) and p.bit_length() == 128
+    assert search.stats.candidates > 0 and search.stats.rounds >= 80
+
+    search = pysafeprime.SafePrimeSearch2(128, sieve_bound = 2 ** 10)
+    while search.step(4) is None:
+        pass
+    p = search.result
+    assert is_prime(p) and is_prime((p - 1) // 2) and p.bit_length() == 128
+
+    for incremental in (False, True):
+        p = pysafeprime.PrimeSearch(128, lambda p : p % 4 == 3, incremental = incremental).run()
+        assert is_prime(p) and p % 4 == 3 and p.bit_length() == 128
+    search = pysafeprime.PrimeSearch(32, lambda p : False)
+    assert_raises(Exception, search.run)
+    assert_raises(Exception, search.step)
+
+    # A step inside a search that timed out stops at the next checkpoint.
+    context = pysafeprime.pysafeprime._SearchContext()
+    context.deadline = context.started = pysafeprime.pysafeprime._timer()
+    pysafeprime.pysafeprime._local.context = context
+    try:
+        assert_raises(pysafeprime.GenerationTimeout, pysafeprime.SafePrimeSearch(128).step)
+    finally:
+        pysafeprime.pysafeprime._local.context = None
+
+def test_search_trace():
+    from pysafeprime import trace
+    with temporary_directory() as directory:
+        path = os.path.join(directory, 'searches.trace')
+        with trace.TraceRecorder(path):
+            primes = [fast_safe_prime(128) for i in range(3)]
+        fast_safe_prime(128)
+        runs = list(trace.read_trace(path))
+        assert len(runs) == 3
+        for run, p in zip(runs, primes):
+            assert (run.function, run.k, run.completed, run.threads) == ('fast_safe_prime', 128, True, 1)
+            found = run.candidates[-1]
+            assert (found.outcome, found.n) == (trace.FOUND, (p - 1) // 2)
+            window = run.windows[found.window]
+            assert window.safe and window.n0 <= found.n < window.n0 + 2 * window.window
+        summary = trace.summarize(runs)
+        assert summary[0]['runs'] == 3 and summary[0]['outcomes']['found'] == 3
+
+        # The worker threads of a call are recorded in the run of the call.
+        with trace.TraceRecorder(path):
+            p = fast_safe_prime(128, workers = 3, executor = 'thread')
+        run = list(trace.read_trace(path))[-1]
+        assert (run.function, run.completed, run.threads) == ('fast_safe_prime', True, 3)
+        found = [c for c in run.candidates if c.outcome == trace.FOUND]
+        assert len(found) == 1 and found[0].n == (p - 1) // 2
+        assert trace.summarize(list(trace.read_trace(path)))[0]['runs'] == 4
+        for run in runs:
+            assert trace.simulate(run) == run.elapsed
+            assert trace.simulate(run, rounds = 80) > run.elapsed
+            assert trace.simulate(run, sieve_bound = 2 ** 8) > 0
+            assert trace.simulate(run, sieve_bound = 2 ** 16) > 0
+
+def test_estimate_cost():
+    from pysafeprime import cost
+    with temporary_directory() as directory:
+        path = os.path.join(directory, 'calibration.json')
+        calibration = cost.calibrate(path)
+        assert cost.load_calibration(path) == json.loads(json.dumps(calibration))
+        for kind in ('prime', 'safe', 'safe2'):
+            small = cost.estimate_cost(kind, 256, calibration = calibration)
+            large = cost.estimate_cost(kind, 1024, calibration = calibration)
+            assert 0 < small['p50'] <= small['p90'] <= small['p99']
+            assert small['mean'] < large['mean'] and small['candidates'] < large['candidates']
+        assert_raises(Exception, cost.estimate_cost, 'nonexistent', 256, calibration = calibration)
+
+def test_metrics():
+    from pysafeprime import metrics
+    metrics.reset()
+    p, stats = fast_safe_prime(128, stats = True)
+    fast_safe_prime(128)
+    safe_prime(32)
+    random_prime(128, workers = 2, executor = 'thread')
+    snapshot = metrics.snapshot()
+
+    def value(name, **labels):
+        return sum(s['value'] for s in snapshot[name] if s['labels'] == labels)
+
+    assert value('pysafeprime_primes_generated_total', function = 'fast_safe_prime', bits = '128') == 2
+    # The primes that safe_prime draws on its way, and the losing workers, are not results.
+    assert value('pysafeprime_primes_generated_total', function = 'safe_prime', bits = '32') == 1
+    assert value('pysafeprime_primes_generated_total', function = 'random_prime', bits = '128') == 1
+    assert value('pysafeprime_candidates_tested_total', function = 'fast_safe_prime') >= stats.candidates + 1
+    assert value('pysafeprime_rabin_rounds_total', function = 'fast_safe_prime') >= stats.rounds + 80
+    assert value('pysafeprime_sieve_rejected_total', function = 'fast_safe_prime') >= stats.sieve_rejections
+    assert value('pysafeprime_random_bytes_total', function = 'safe_prime') > 0
+    assert value('pysafeprime_cpu_seconds_total', function = 'random_prime') > 0
+    histogram = [s for s in snapshot['pysafeprime_call_seconds'] if s['labels']['function'] == 'fast_safe_prime'][0]
+    assert histogram['count'] == 2 and list(histogram['buckets'].values())[-1] == 2
+
+    text = metrics.prometheus_text()
+    assert '# TYPE pysafeprime_call_seconds histogram' in text
+    assert 'pysafeprime_primes_generated_total{bits="128",function="fast_safe_prime"} 2\n' in text
+    assert 'pysafeprime_call_seconds_count{bits="128",function="fast_safe_prime"} 2\n' in text
+    assert 'pysafeprime_call_seconds_bucket{bits="128",function="fast_safe_prime",le="+Inf"} 2\n' in text
+
+    # The shards of ended worker threads are folded away, keeping their counts.
+    cpu = value('pysafeprime_cpu_seconds_total', function = 'random_prime')
+    for i in range(10):
+        random_prime(64, workers = 4, executor = 'thread')
+    assert len(metrics._shards) < 10
+    snapshot = metrics.snapshot()
+    assert value('pysafeprime_primes_generated_total', function = 'random_prime', bits = '64') == 10
+    assert value('pysafeprime_cpu_seconds_total', function = 'random_prime') > cpu
+
+def test_moduli_pipeline():
+    from pysafeprime import moduli
+    with temporary_directory() as directory:
+        candidates = os.path.join(directory, 'moduli.candidates')
+        safe = os.path.join(directory, 'moduli.safe')
+        checkpoint = os.path.join(directory, 'moduli.checkpoint')
+        with open(candidates, 'w') as f:
+            n = moduli.generate_candidates(f, 128, windows = 4)
+        with open(candidates) as f:
+            entries = list(moduli.read_moduli(f))
+        assert len(entries) == n
+        for entry in entries:
+            assert entry.type == moduli.MODULI_TYPE_SOPHIE_GERMAIN
+            assert entry.size == 126 and bit_length(entry.modulus) == 127
+
+        # Screen the first half, then resume from the checkpoint with a process pool.
+        with open(candidates) as f, open(safe, 'w') as out:
+            first = moduli.screen_candidates(itertools.islice(f, n // 2), out, checkpoint = checkpoint)
+        with open(candidates) as f, open(safe, 'a') as out:
+            second = moduli.screen_candidates(f, out, processes = 2, checkpoint = checkpoint)
+        with open(checkpoint) as f:
+            assert int(f.read()) == n
+        with open(safe) as f:
+            lines = f.readlines()
+        assert len(lines) == first + second > 0
+        for line in lines:
+            assert len(line.split()) == 7
+            entry = moduli.parse_modulus(line)
+            assert entry.type == moduli.MODULI_TYPE_SAFE
+            assert entry.tests == moduli.MODULI_TESTS_SIEVE | moduli.MODULI_TESTS_MILLER_RABIN
+            assert entry.size == 127 and entry.generator in (2, 5)
+            check_safe_prime(entry.modulus)
+            assert moduli.format_modulus(entry) == line
+
+def test_prime_store():
+    from pysafeprime import store
+    with temporary_directory() as directory:
+        path = os.path.join(directory, 'primes.store')
+        primes = [fast_safe_prime(k) for k in (64, 64, 65, 128)] + [2 ** 127 - 1]
+        assert store.write_store(path, primes) == {64: 2, 65: 1, 127: 1, 128: 1}
+        with store.PrimeStore(path) as s:
+            assert len(s) == 5
+            assert s.sizes() == [64, 65, 127, 128]
+            assert list(s.primes(64)) == primes[:2]
+            assert s.get(127, 0) == 2 ** 127 - 1
+            assert s.random(64) in primes[:2]
+            assert s.random(128) == primes[3]
+            assert s.count(256) == 0
+            assert_raises(Exception, s.random, 256)
+            assert_raises(IndexError, s.get, 65, 1)
+        with open(path, 'wb') as f:
+            f.write(b'\x00' * 64)
+        assert_raises(Exception, store.PrimeStore, path)
+
+def test_command_line():
+    with temporary_directory() as directory:
+        manifest = os.path.join(directory, 'manifest.json')
+        results = os.path.join(directory, 'results.jsonl')
+        with open(manifest, 'w') as f:
+            json.dump({'jobs': [{'kind': 'safe', 'sizes': [64, 96], 'count': 2},
+                {'kind': 'prime', 'sizes': [128], 'workers': 2}]}, f)
+        output = subprocess.check_output([sys.executable, '-m', 'pysafeprime', 'generate', '--manifest', manifest])
+        records = [json.loads(line) for line in output.decode('ascii').splitlines()]
+        assert [(r['job'], r['kind'], r['bits']) for r in records] == [(0, 'safe', 64), (0, 'safe', 64),
+            (0, 'safe', 96), (0, 'safe', 96), (1, 'prime', 128)]
+        for r in records:
+            assert bit_length(int(r['value'], 16)) == r['bits']
+
+        with open(results, 'wb') as f:
+            f.write(output)
+        with open(os.devnull, 'w') as devnull:
+            verify = lambda : subprocess.call([sys.executable, '-m', 'pysafeprime', 'verify', results],
+                stdout = devnull)
+            assert verify() == 0
+            with open(results, 'a') as f:
+                f.write(json.dumps({'kind': 'safe', 'value': hex(2 ** 127 - 1)}) + '\n')
+            assert verify() == 1
+
+def test_bench_suite():
+    from pysafeprime import bench
+    assert bench.percentile([1, 2, 3, 4], 50) == 2
+    assert bench.percentile([1, 2, 3, 4], 99) == 4
+    # The same seed draws the same candidates, and a different seed does not.
+    runs = [bench.measure('fast_safe_prime', 96, 5, seed) for seed in (7, 7, 8)]
+    assert runs[0][1] == runs[1][1] != runs[2][1]
+    # Other threads keep drawing from os.urandom while a benchmark runs.
+    draws = []
+
+    def draw_on_thread(stage, value):
+        thread = threading.Thread(target = lambda : draws.append(pysafeprime.pysafeprime._draw(16)))
+        thread.start()
+        thread.join()
+
+    pysafeprime.add_hook('found', draw_on_thread)
+    try:
+        bench.measure('fast_safe_prime', 96, 1, 7)
+        bench.measure('fast_safe_prime', 96, 1, 7)
+    finally:
+        pysafeprime.remove_hook('found', draw_on_thread)
+    assert len(draws) == 2 and draws[0] != draws[1]
+    results = list(bench.run_suite(['is_prime', 'random_prime_incremental'], [64, 128], 10))
+    assert [(r['benchmark'], r['bits']) for r in results] == [('is_prime', 64), ('is_prime', 128),
+        ('random_prime_incremental', 64), ('random_prime_incremental', 128)]
+    for r in results:
+        assert r['samples'] == 10
+        assert r['p50'] <= r['p90'] <= r['p99'] <= r['max']
+    assert results[0]['candidates_per_success'] is None
+    assert results[2]['candidates_per_success'] >= 1
+
+def test_regression_gate():
+    from pysafeprime import regression
+    assert regression.bootstrap_interval([1.0] * 10, [2.0] * 10) == (2.0, 2.0)
+    rabin_steps = pysafeprime.pysafeprime._rabin_steps
+
+    def slow_rabin_steps(n, t, backend = None):
+        time.sleep(0.01)
+        return rabin_steps(n, t, backend)
+
+    with temporary_directory() as directory:
+        path = os.path.join(directory, 'baseline.json')
+        try:
+            regression.record_baseline(path, ['fast_safe_prime'], [64], 10)
+            results = list(regression.compare(path, tolerance = 1.0))
+            assert len(results) == 1 and not results[0]['regressed']
+            assert results[0]['candidates_ratio'] == 1.0
+            pysafeprime.pysafeprime._rabin_steps = slow_rabin_steps
+            results = list(regression.compare(path, tolerance = 1.0))
+            assert results[0]['regressed'] and results[0]['low'] > 2
+        finally:
+            pysafeprime.pysafeprime._rabin_steps = rabin_steps
+
+def test_lazy_imports():
+    output = subprocess.check_output([sys.executable, '-c',
+        'import sys, pysafeprime; print(sorted(set(["asyncio", "pysafeprime.aio", "pysafeprime.cost"]) & set(sys.modules)))'])
+    assert output.decode('ascii').strip() == '[]' or sys.version_info < (3, 7)
+    from pysafeprime import cost
+    assert pysafeprime.estimate_cost is cost.estimate_cost
+
+def _import_aio():
+    try:
+        from pysafeprime import aio
+    except SyntaxError:
+        raise SkipTest('asyncio is not available')
+    return aio
+
+def test_aio_generators():
+    aio = _import_aio()
+    import asyncio
+    loop = asyncio.new_event_loop()
+    try:
+        p = loop.run_until_complete(aio.fast_safe_prime_async(128))
+        assert bit_length(p) == 128
+        check_safe_prime(p)
+        p = loop.run_until_complete(aio.random_prime_async(128, incremental = True))
+        assert bit_length(p) == 128
+        assert is_prime(p)
+
+        primes = []
+        iterator = aio.primes_async(128, count = 3, maxsize = 2)
+        while True:
+            try:
+                primes.append(loop.run_until_complete(iterator.__anext__()))
+            except StopAsyncIteration:
+                break
+        assert len(primes) == 3
+        assert all(is_prime(p) for p in primes)
+
+        # The search context of an enclosing search on the thread is kept.
+        context = pysafeprime.pysafeprime._SearchContext()
+        with pysafeprime.pysafeprime._search_context(context):
+            assert aio._run_cancellable(threading.Event(), is_prime, (7,), {})
+            assert pysafeprime.pysafeprime._local.context is context
+        assert pysafeprime.pysafeprime._local.context is None
+
+        # With maxsize = 1, one result is generated ahead of the consumer.
+        calls = []
+        iterator = aio.iterate_async(lambda : calls.append(None) or len(calls), maxsize = 1)
+        assert loop.run_until_complete(iterator.__anext__()) == 1
+        loop.run_until_complete(asyncio.sleep(0.2))
+        assert len(calls) == 2
+        loop.run_until_complete(iterator.aclose())
+    finally:
+        loop.close()
+
+def test_aio_cancel():
+    aio = _import_aio()
+    import asyncio
+    import concurrent.futures
+    executor = concurrent.futures.ThreadPoolExecutor(1)
+    aio.set_executor(executor)
+    loop = asyncio.new_event_loop()
+    try:
+        task = loop.create_task(aio.fast_safe_prime_async(4096))
+        loop.run_until_complete(asyncio.sleep(0.2))
+        task.cancel()
+        assert_raises(asyncio.CancelledError, loop.run_until_complete, task)
+        # The only executor thread is free again once the search has stopped.
+        assert executor.submit(lambda : 1).result(timeout = 30) == 1
+    finally:
+        loop.close()
+        aio.set_executor(None)
+        executor.shutdown()
 
 #def test_safe_prime_1024():
 #    p = safe_prime(1024)